@@ -0,0 +1,50 @@
+"""
+Compares two benchmark result files produced by `bench.run`:
+
+    python -m bench.compare baseline.json candidate.json --threshold 0.10
+
+Exits with status 1 when any operation's p50 or p95 got slower than the threshold.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ["p50_ms", "p95_ms", "p99_ms", "mean_ms"]
+GATED_METRICS = ["p50_ms", "p95_ms"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two CDOTS benchmark results")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline {baseline['meta'].get('commit')}  vs  candidate {candidate['meta'].get('commit')}")
+    regressions = []
+    for op, old in baseline["results"].items():
+        new = candidate["results"].get(op)
+        if not new:
+            continue
+        cells = []
+        for metric in METRICS:
+            if not old.get(metric) or metric not in new:
+                continue
+            change = (new[metric] - old[metric]) / old[metric]
+            cells.append(f"{metric}={new[metric]:.2f} ({change:+.1%})")
+            if metric in GATED_METRICS and change > args.threshold:
+                regressions.append(f"{op} {metric}")
+        print(f"{op:20s} " + "  ".join(cells))
+
+    if regressions:
+        print("regressions: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+HTTP load generator for a running CDOTS app. Start the app with the stand-in model
+and a local mongod, seed it, then sweep concurrency levels:
+
+    environment=bench_local uvicorn runner:app --port 8000 --workers 1
+    python -m bench.seed --users 5000 --manifest bench_manifest.json
+    python -m bench.load_test --manifest bench_manifest.json --concurrency 1 2 4 8 16 32 \
+        --mix search=5 login=2 me=2 register=1 add_family_member=1 connect_trees=1
+
+Each level runs a closed loop of `concurrency` clients for `--duration` seconds and reports
+throughput, p50/p95/p99 and error rate per route.
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import random
+import sys
+import time
+import uuid
+
+import cv2
+import httpx
+import numpy as np
+
+from bench.stats import summarize
+
+DEFAULT_MIX = ["search=5", "login=2", "me=2", "register=1", "add_family_member=1", "connect_trees=1"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CDOTS HTTP load test")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--manifest", default="bench_manifest.json", help="written by `python -m bench.seed`")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per concurrency level")
+    parser.add_argument("--mix", nargs="+", default=DEFAULT_MIX, help="route=weight pairs")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout in seconds")
+    parser.add_argument("--p99-budget-ms", type=float, default=2000.0, help="p99 above this marks a collapsed level")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write JSON results to this file")
+    return parser.parse_args()
+
+
+def parse_mix(pairs):
+    mix = {}
+    for pair in pairs:
+        route, _, weight = pair.partition("=")
+        if route not in ROUTES:
+            sys.exit(f"unknown route '{route}', choose from {sorted(ROUTES)}")
+        mix[route] = float(weight or 1)
+    return mix
+
+
+def make_images(count, rng, size=256):
+    images = []
+    for _ in range(count):
+        ok, buf = cv2.imencode(".jpg", rng.integers(0, 256, (size, size, 3), dtype=np.uint8))
+        images.append(buf.tobytes())
+    return images
+
+
+class Traffic:
+    """Shared state the route functions draw from: seeded users and trees, auth header and image pool."""
+
+    def __init__(self, manifest, rng):
+        self.users = manifest["users"]
+        self.password = manifest["password"]
+        self.trees = manifest["trees"]
+        self.tree_ids = list(self.trees)
+        self.images = make_images(64, rng)
+        # Written by bench.seed with planted matches among the seeded users
+        self.query_images = [base64.b64decode(image) for image in manifest.get("query_images", [])]
+        self.rng = random.Random(int(rng.integers(1 << 31)))
+        self.run_id = uuid.uuid4().hex[:8]
+        self.counter = itertools.count()
+        self.headers = {}
+
+    def image(self):
+        return self.rng.choice(self.images)
+
+    def query_image(self):
+        return self.rng.choice(self.query_images or self.images)
+
+
+async def route_search(client, traffic):
+    return await client.post("/api/v1/fetch-similar-members-by-pic", headers=traffic.headers,
+                             files={"profile_pic": ("query.jpg", traffic.query_image(), "image/jpeg")})
+
+
+async def route_login(client, traffic):
+    user = traffic.rng.choice(traffic.users)
+    return await client.post("/api/v1/login", data={"email": user["email"], "password": traffic.password})
+
+
+async def route_me(client, traffic):
+    return await client.get("/api/v1/me", headers=traffic.headers)
+
+
+async def route_register(client, traffic):
+    n = next(traffic.counter)
+    return await client.post("/api/v1/register",
+                             data={"full_name": f"Load {n}", "email": f"load_{traffic.run_id}_{n}@example.com",
+                                   "password": traffic.password, "re_enter_password": traffic.password},
+                             files={"profile_pic": ("profile.jpg", traffic.image(), "image/jpeg")})
+
+
+async def route_add_family_member(client, traffic):
+    tree_id = traffic.rng.choice(traffic.tree_ids)
+    return await client.post("/api/v1/add-family-member", headers=traffic.headers,
+                             data={"tree_id": tree_id,
+                                   "user_id": traffic.rng.choice(traffic.users)["user_id"],
+                                   "parent_user_id": traffic.rng.choice(traffic.trees[tree_id]),
+                                   "relation_name": "child"})
+
+
+async def route_connect_trees(client, traffic):
+    tree_1, tree_2 = traffic.rng.sample(traffic.tree_ids, 2)
+    return await client.post("/api/v1/connect-family-trees/", headers=traffic.headers,
+                             data={"tree_1_id": tree_1, "tree_2_id": tree_2})
+
+
+ROUTES = {
+    "search": route_search,
+    "login": route_login,
+    "me": route_me,
+    "register": route_register,
+    "add_family_member": route_add_family_member,
+    "connect_trees": route_connect_trees,
+}
+
+
+async def client_loop(client, traffic, mix, deadline, samples):
+    routes, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        route = traffic.rng.choices(routes, weights)[0]
+        start = time.perf_counter()
+        try:
+            response = await ROUTES[route](client, traffic)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        samples.append((route, (time.perf_counter() - start) * 1000, status))
+
+
+def report_level(samples, elapsed_s):
+    by_route = {}
+    for route, latency, status in samples:
+        by_route.setdefault(route, []).append((latency, status))
+    routes = {}
+    for route, rows in sorted(by_route.items()):
+        errors = sum(1 for _, status in rows if status != 200)
+        summary = summarize([latency for latency, _ in rows], elapsed_s)
+        summary["errors"] = errors
+        summary["error_rate"] = round(errors / len(rows), 4)
+        routes[route] = summary
+    overall = summarize([latency for _, latency, _ in samples], elapsed_s)
+    overall_errors = sum(1 for _, _, status in samples if status != 200)
+    overall["error_rate"] = round(overall_errors / len(samples), 4) if samples else 0.0
+    return {"overall": overall, "routes": routes}
+
+
+async def run(args):
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    mix = parse_mix(args.mix)
+    traffic = Traffic(manifest, np.random.default_rng(args.seed))
+
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        user = manifest["users"][0]
+        login = await client.post("/api/v1/login", data={"email": user["email"], "password": traffic.password})
+        login.raise_for_status()
+        traffic.headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        levels = []
+        for concurrency in args.concurrency:
+            samples = []
+            start = time.perf_counter()
+            deadline = start + args.duration
+            await asyncio.gather(*(client_loop(client, traffic, mix, deadline, samples) for _ in range(concurrency)))
+            level = {"concurrency": concurrency, **report_level(samples, time.perf_counter() - start)}
+            levels.append(level)
+
+            overall = level["overall"]
+            print(f"concurrency={concurrency:<4d} ops/s={overall.get('ops_per_s', 0):<8} "
+                  f"p50={overall.get('p50_ms')}ms p95={overall.get('p95_ms')}ms p99={overall.get('p99_ms')}ms "
+                  f"errors={overall['error_rate']:.2%}")
+            for route, summary in level["routes"].items():
+                print(f"    {route:20s} ops/s={summary.get('ops_per_s', 0):<8} p50={summary['p50_ms']}ms "
+                      f"p95={summary['p95_ms']}ms p99={summary['p99_ms']}ms errors={summary['error_rate']:.2%}")
+
+    collapsed = [l["concurrency"] for l in levels
+                 if (l["overall"].get("p99_ms") or 0) > args.p99_budget_ms or l["overall"]["error_rate"] > 0.01]
+    if collapsed:
+        print(f"p99 budget ({args.p99_budget_ms}ms) or 1% error rate exceeded from concurrency {collapsed[0]}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"base_url": args.base_url, "duration_s": args.duration, "mix": mix,
+                       "p99_budget_ms": args.p99_budget_ms, "levels": levels}, f, indent=4)
+
+
+def main():
+    asyncio.run(run(parse_args()))
+
+
+if __name__ == "__main__":
+    main()
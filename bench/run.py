@@ -0,0 +1,176 @@
+"""
+Offline benchmark suite for the CDOTS API.
+
+Runs against the deterministic fake face model and either an in-process mongomock
+database (`--target mock`, default) or a local mongod (`--target local`, database
+`cdots_bench`). Run from the repository root:
+
+    python -m bench.run --users 5000 --trees 200 --depth 3 --fanout 3 --output results.json
+    python -m bench.compare baseline.json results.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+TARGET_ENVIRONMENTS = {"mock": "bench", "local": "bench_local"}
+OPERATIONS = ["search", "search_miss", "register", "login", "add_family_member", "connect_trees"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CDOTS offline benchmark suite")
+    parser.add_argument("--target", choices=TARGET_ENVIRONMENTS, default="mock")
+    parser.add_argument("--users", type=int, default=2000, help="synthetic users with embeddings")
+    parser.add_argument("--trees", type=int, default=100, help="synthetic family trees")
+    parser.add_argument("--depth", type=int, default=3, help="tree depth")
+    parser.add_argument("--fanout", type=int, default=3, help="children per tree member")
+    parser.add_argument("--queries", type=int, default=8, help="search query images with planted matches")
+    parser.add_argument("--matches-per-query", type=int, default=20, help="seeded users planted near each query")
+    parser.add_argument("--iterations", type=int, default=50, help="timed calls per operation")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed calls per operation")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--ops", nargs="+", choices=OPERATIONS, default=OPERATIONS)
+    parser.add_argument("--output", help="write JSON results to this file (default: stdout)")
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def measure(fn, iterations, warmup):
+    from bench.stats import summarize
+
+    for i in range(warmup):
+        fn(i)
+    latencies = []
+    run_start = time.perf_counter()
+    for i in range(warmup, warmup + iterations):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return summarize(latencies, time.perf_counter() - run_start)
+
+
+def check(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.request.method} {response.request.url} -> {response.status_code}: {response.text}")
+    return response
+
+
+def main():
+    args = parse_args()
+
+    # The config module reads the environment at import time, so select it before importing the app
+    os.environ["environment"] = TARGET_ENVIRONMENTS[args.target]
+
+    import numpy as np
+    from fastapi.testclient import TestClient
+
+    from bench import synthetic
+    from cdots.core.config import MONGO_DB_NAME
+    from cdots.db.mongo.mongo_connection import MongoDBConnection
+    from cdots.main import app
+
+    if not MONGO_DB_NAME.startswith("cdots_bench"):
+        sys.exit(f"refusing to benchmark against database '{MONGO_DB_NAME}'")
+
+    db = MongoDBConnection().get_db()
+    rng = np.random.default_rng(args.seed)
+    setup_start = time.perf_counter()
+    user_ids, tree_ids = synthetic.seed_database(db, args.users, args.trees, args.depth, args.fanout, rng)
+    query_images = synthetic.seed_search_queries(db, user_ids, args.queries, args.matches_per_query, rng)
+    setup_s = time.perf_counter() - setup_start
+
+    client = TestClient(app)
+    login = check(client.post("/api/v1/login", data={"email": synthetic.bench_email(0), "password": synthetic.BENCH_PASSWORD}))
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    tree_members = {}
+    for tree in db.family_trees.find({}, {"members": 1}):
+        tree_members[tree["_id"]] = synthetic.tree_member_ids(tree["members"])
+
+    match_counts = {"search": [], "search_miss": []}
+
+    def search_with(name, image):
+        response = check(client.post("/api/v1/fetch-similar-members-by-pic", headers=headers,
+                                     files={"profile_pic": ("query.jpg", image, "image/jpeg")}))
+        match_counts[name].append(len(response.json()["matched_users"]))
+
+    def search(i):
+        # Cycles through the query images whose matches were planted in the seeded users
+        search_with("search", query_images[i % len(query_images)] if query_images else synthetic.random_image(rng))
+
+    def search_miss(i):
+        search_with("search_miss", synthetic.random_image(rng))
+
+    def register(i):
+        image = synthetic.random_image(rng)
+        check(client.post("/api/v1/register",
+                          data={"full_name": f"Registered {i}", "email": f"bench_register_{i}@example.com",
+                                "password": synthetic.BENCH_PASSWORD, "re_enter_password": synthetic.BENCH_PASSWORD},
+                          files={"profile_pic": ("profile.jpg", image, "image/jpeg")}))
+
+    def login_user(i):
+        email = synthetic.bench_email(int(rng.integers(args.users)))
+        check(client.post("/api/v1/login", data={"email": email, "password": synthetic.BENCH_PASSWORD}))
+
+    def add_family_member(i):
+        tree_id = tree_ids[int(rng.integers(len(tree_ids)))]
+        members = tree_members[tree_id]
+        check(client.post("/api/v1/add-family-member", headers=headers,
+                          data={"tree_id": tree_id,
+                                "user_id": user_ids[int(rng.integers(len(user_ids)))],
+                                "parent_user_id": members[int(rng.integers(len(members)))],
+                                "relation_name": "child"}))
+
+    def connect_trees(i):
+        tree_1, tree_2 = rng.choice(tree_ids, size=2, replace=False)
+        check(client.post("/api/v1/connect-family-trees/", headers=headers,
+                          data={"tree_1_id": str(tree_1), "tree_2_id": str(tree_2)}))
+
+    operations = {
+        "search": search,
+        "search_miss": search_miss,
+        "register": register,
+        "login": login_user,
+        "add_family_member": add_family_member,
+        "connect_trees": connect_trees,
+    }
+
+    results = {}
+    for name in args.ops:
+        if name in ("add_family_member", "connect_trees") and len(tree_ids) < 2:
+            continue
+        results[name] = measure(operations[name], args.iterations, args.warmup)
+        if name in match_counts:
+            results[name]["matches_mean"] = round(float(np.mean(match_counts[name])), 2)
+        print(f"{name}: {results[name]}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "target": args.target,
+            "params": {k: v for k, v in vars(args).items() if k != "output"},
+            "setup_s": round(setup_s, 3),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Seeds the local `cdots_bench` database for load tests and writes a manifest with the
+generated user and tree ids:
+
+    python -m bench.seed --users 5000 --trees 200 --manifest bench_manifest.json
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed the CDOTS benchmark database")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--trees", type=int, default=100)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=8, help="search query images with planted matches")
+    parser.add_argument("--matches-per-query", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--manifest", default="bench_manifest.json")
+    args = parser.parse_args()
+
+    os.environ["environment"] = "bench_local"
+
+    import numpy as np
+
+    from bench import synthetic
+    from cdots.core.config import MONGO_DB_NAME
+    from cdots.db.mongo.mongo_connection import MongoDBConnection
+
+    if not MONGO_DB_NAME.startswith("cdots_bench"):
+        sys.exit(f"refusing to seed database '{MONGO_DB_NAME}'")
+
+    db = MongoDBConnection().get_db()
+    rng = np.random.default_rng(args.seed)
+    user_ids, tree_ids = synthetic.seed_database(db, args.users, args.trees, args.depth, args.fanout, rng)
+    query_images = synthetic.seed_search_queries(db, user_ids, args.queries, args.matches_per_query, rng)
+    trees = {t["_id"]: synthetic.tree_member_ids(t["members"]) for t in db.family_trees.find({}, {"members": 1})}
+
+    with open(args.manifest, "w") as f:
+        json.dump({
+            "users": [{"user_id": user_id, "email": synthetic.bench_email(i)} for i, user_id in enumerate(user_ids)],
+            "password": synthetic.BENCH_PASSWORD,
+            "trees": trees,
+            "query_images": [base64.b64encode(image).decode() for image in query_images],
+        }, f)
+    print(f"seeded {len(user_ids)} users and {len(tree_ids)} trees into {MONGO_DB_NAME}, manifest: {args.manifest}")
+
+
+if __name__ == "__main__":
+    main()
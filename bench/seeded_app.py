@@ -0,0 +1,22 @@
+"""
+App entry point for memory measurements: installs a synthetic in-memory embedding index of
+`CDOTS_BENCH_USERS` users (default 100000) before importing the app, so a preloading gunicorn
+master builds it once like it would from a real `users_face_embeddings`:
+
+    environment=bench_memory python scripts/measure_worker_memory.py --app bench.seeded_app:app
+"""
+import os
+
+import numpy as np
+
+from bench import synthetic
+from cdots.core.embedding_index import EmbeddingIndex
+from cdots.core.face_search import SearchIndexSingleton
+from cdots.core.utils import get_unique_mongo_id
+
+users = int(os.getenv("CDOTS_BENCH_USERS", "100000"))
+rng = np.random.default_rng(42)
+SearchIndexSingleton._instance = EmbeddingIndex([get_unique_mongo_id() for _ in range(users)],
+                                                synthetic.random_unit_embeddings(users, rng))
+
+from cdots.main import app  # noqa: E402
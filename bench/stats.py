@@ -0,0 +1,28 @@
+import math
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies_ms, elapsed_s=None):
+    """Latency summary in milliseconds; throughput when the wall time of the run is given."""
+    values = sorted(latencies_ms)
+    if not values:
+        return {"count": 0}
+    summary = {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 3),
+        "min_ms": round(values[0], 3),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "max_ms": round(values[-1], 3),
+    }
+    if elapsed_s:
+        summary["ops_per_s"] = round(len(values) / elapsed_s, 2)
+    return summary
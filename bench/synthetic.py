@@ -0,0 +1,145 @@
+"""
+Synthetic data for benchmarks: users with random unit 512-d embeddings,
+family trees of configurable depth and fan-out written straight to Mongo, and
+query images with planted near-duplicates among the users so searches match.
+"""
+import datetime
+
+import cv2
+import numpy as np
+from pymongo import UpdateOne
+
+from cdots.core.config import pwd_context
+from cdots.core.utils import get_unique_mongo_id
+
+BENCH_PASSWORD = "bench-password"
+EMBEDDING_SIZE = 512
+
+
+def bench_email(i):
+    return f"bench_user_{i}@example.com"
+
+
+def random_unit_embeddings(n, rng):
+    vectors = rng.standard_normal((n, EMBEDDING_SIZE)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def random_image(rng, size=256):
+    """Returns JPEG bytes of a random image; with the fake face model every distinct image is a distinct face."""
+    img = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    ok, buf = cv2.imencode(".jpg", img)
+    return buf.tobytes()
+
+
+def generate_users(db, n, rng, batch_size=1000):
+    """Inserts `n` users and their embeddings, returns the list of user ids."""
+    # bcrypt is deliberately slow, hash the shared password once
+    password_hash = pwd_context.hash(BENCH_PASSWORD)
+    user_ids = []
+    for start in range(0, n, batch_size):
+        count = min(batch_size, n - start)
+        embeddings = random_unit_embeddings(count, rng)
+        users, face_embeddings = [], []
+        for offset in range(count):
+            user_id = get_unique_mongo_id()
+            users.append({
+                "_id": user_id,
+                "full_name": f"Bench User {start + offset}",
+                "email": bench_email(start + offset),
+                "password": password_hash,
+                "profile_pic": None,
+                "t__created_at": datetime.datetime.now(),
+            })
+            face_embeddings.append({
+                "_id": user_id,
+                "user_id": user_id,
+                "face_embedding": embeddings[offset].tolist(),
+            })
+            user_ids.append(user_id)
+        db.users.insert_many(users)
+        db.users_face_embeddings.insert_many(face_embeddings)
+    return user_ids
+
+
+def _build_member(user_ids, rng, relation_name, depth, fanout):
+    member = {
+        "user_id": user_ids[int(rng.integers(len(user_ids)))],
+        "relation_name": relation_name,
+        "children": [],
+    }
+    if depth > 1:
+        member["children"] = [_build_member(user_ids, rng, "child", depth - 1, fanout) for _ in range(fanout)]
+    return member
+
+
+def generate_trees(db, user_ids, m, depth, fanout, rng):
+    """Inserts `m` trees whose members are drawn from `user_ids`, returns the list of tree ids."""
+    trees = []
+    for i in range(m):
+        root = _build_member(user_ids, rng, "self", depth, fanout)
+        trees.append({
+            "_id": get_unique_mongo_id(),
+            "tree_name": f"Bench Tree {i}",
+            "created_by": root["user_id"],
+            "members": [root],
+        })
+    if trees:
+        db.family_trees.insert_many(trees)
+    return [t["_id"] for t in trees]
+
+
+def tree_member_ids(members):
+    ids = []
+    for member in members:
+        ids.append(member["user_id"])
+        ids.extend(tree_member_ids(member.get("children", [])))
+    return ids
+
+
+def noisy_copies(embedding, n, rng, min_cosine=0.35, max_cosine=0.95):
+    """`n` unit vectors around `embedding` with cosine similarities spread over [min_cosine, max_cosine]."""
+    # For a unit vector plus N(0, sigma^2 I) noise in d dimensions, cosine ~ 1 / sqrt(1 + d * sigma^2)
+    cosines = rng.uniform(min_cosine, max_cosine, n)
+    sigmas = np.sqrt((1 / cosines ** 2 - 1) / EMBEDDING_SIZE)
+    vectors = embedding + sigmas[:, None] * rng.standard_normal((n, EMBEDDING_SIZE))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def seed_search_queries(db, user_ids, queries, matches_per_query, rng):
+    """
+    Creates `queries` query images and overwrites the embeddings of `matches_per_query`
+    distinct seeded users per query with noisy copies of the query's face embedding
+    (match percentages ~35-95), so searches return real matches and exercise ranking and
+    hydration. Embeddings come from the configured face model (the fake one in benchmarks).
+    Returns the query images.
+    """
+    from cdots.core.face_analysis import FaceAppSingleton
+
+    face_app = FaceAppSingleton.get_instance()
+    planted = rng.permutation(len(user_ids))
+    images = []
+    for q in range(queries):
+        image = random_image(rng)
+        faces = face_app.get(cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR))
+        embedding = faces[0].embedding / np.linalg.norm(faces[0].embedding)
+        targets = planted[q * matches_per_query:(q + 1) * matches_per_query]
+        vectors = noisy_copies(embedding, len(targets), rng)
+        if len(targets):
+            db.users_face_embeddings.bulk_write([
+                UpdateOne({"_id": user_ids[t]}, {"$set": {"face_embedding": vector.tolist()}})
+                for t, vector in zip(targets, vectors)
+            ])
+        images.append(image)
+    return images
+
+
+def seed_database(db, users, trees, depth, fanout, rng):
+    """Drops the benchmark collections and fills them with fresh synthetic data."""
+    for collection in ["users", "users_face_embeddings", "family_trees"]:
+        db[collection].drop()
+    user_ids = generate_users(db, users, rng)
+    tree_ids = generate_trees(db, user_ids, trees, depth, fanout, rng)
+    return user_ids, tree_ids
@@ -4,6 +4,7 @@ import datetime
 from pydantic import BaseModel, EmailStr
 from cdots.core.config import SECRET_KEY, ALGORITHM, pwd_context, TOKEN_EXPIRE_DAYS
 from cdots.db.mongo.mongo_connection import MongoDBConnection
+from cdots.core.utils import run_blocking
 
 router = APIRouter(prefix="/api/v1", tags=["User Authentication"])
 
@@ -44,7 +45,8 @@ async def login_user(
     """
     user = db.users.find_one({"email": email})
 
-    if not user or not pwd_context.verify(password, user["password"]):
+    # bcrypt is deliberately slow, keep it off the event loop
+    if not user or not await run_blocking(pwd_context.verify, password, user["password"]):
         raise HTTPException(status_code=400, detail="Invalid credentials")
 
     token = create_access_token(user["email"], user["_id"])
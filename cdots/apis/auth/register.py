@@ -3,15 +3,19 @@ import uuid
 import os
 import cv2
 import numpy as np
-from fastapi import APIRouter, HTTPException, Depends, Form, UploadFile, File
+from fastapi import APIRouter, HTTPException, Depends, Form, UploadFile, File, Header
 from pydantic import BaseModel, EmailStr, Field
 
-from cdots.core.config import SECRET_KEY, ALGORITHM, pwd_context
+from cdots.core.admission import inference_limiter
+from cdots.core.config import SECRET_KEY, ALGORITHM, pwd_context, ADMISSION_ENABLED
 from cdots.db.mongo.mongo_connection import MongoDBConnection
 from cdots.core.config import MONGO_URI, MONGO_DB_NAME
 from cdots.core.config import STATIC_FOLDER_PATH
-from cdots.core.face_analysis import FaceAppSingleton
-from cdots.core.utils import get_unique_mongo_id
+from cdots.core.face_analysis import FaceAppSingleton, detect_faces, embed_faces
+from cdots.core.face_quality import check_face_quality
+from cdots.core.face_search import add_to_search_index
+from cdots.core.job_queue import job_queue
+from cdots.core.utils import get_unique_mongo_id, run_blocking
 
 router = APIRouter(prefix="/api/v1", tags=["User Authentication"])
 
@@ -26,6 +30,10 @@ db = db_connection.get_db()
 profile_pics = "profile_pics"
 abs_profile_pics_path = os.path.join(STATIC_FOLDER_PATH, profile_pics)
 os.makedirs(abs_profile_pics_path, exist_ok=True)
+# Uploads waiting for a registration job
+registration_uploads = "registration_uploads"
+abs_registration_uploads_path = os.path.join(STATIC_FOLDER_PATH, registration_uploads)
+os.makedirs(abs_registration_uploads_path, exist_ok=True)
 
 # Util: Normalize embedding
 def l2_normalize(vec):
@@ -42,31 +50,29 @@ class UserRegister(BaseModel):
     profile_pic: UploadFile = File(None)
 
 
-@router.post("/register")
-async def register_user(
-        full_name: str = Form(...),
-        email: EmailStr = Form(...),
-        password: str = Form(..., min_length=6),
-        re_enter_password: str = Form(..., min_length=6, alias="re_enter_password"),
-        profile_pic: UploadFile = File(None)
-):
-    if password != re_enter_password:
-        raise HTTPException(status_code=400, detail="Passwords do not match")
+def create_user_with_face(full_name, email, password_hash, img_bytes, filename, user_id=None, set_step=None):
+    """
+    Detects the face in a profile picture and creates the user and its face embedding.
+    Used by the synchronous route and by registration jobs; re-running it with the same
+    `user_id` overwrites the same documents, so a retried job does not create duplicates.
+    """
+    set_step = set_step or (lambda step: None)
+    user_id = user_id or get_unique_mongo_id()
 
-    existing_user = db.users.find_one({"email": email})
-    if existing_user:
+    existing_user = db.users.find_one({"email": email}, {"_id": 1})
+    if existing_user and existing_user["_id"] != user_id:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    if not profile_pic:
-        raise HTTPException(status_code=400, detail="Profile picture is required")
-
     # Step 1: Read image from memory
-    img_bytes = await profile_pic.read()
+    set_step("decoding")
     nparr = np.frombuffer(img_bytes, np.uint8)
     img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if img is None:
+        raise HTTPException(status_code=400, detail="Invalid image format")
 
-    # Step 2: Detect face
-    faces = face_app.get(img)
+    # Step 2: Detect faces (recognition runs later, for the selected face only)
+    set_step("detecting")
+    faces = detect_faces(face_app, img)
     if not faces:
         raise HTTPException(status_code=400, detail="No face detected in the uploaded image")
 
@@ -79,46 +85,186 @@ async def register_user(
     if cropped_face.size == 0:
         raise HTTPException(status_code=400, detail="Cropped face is empty or invalid")
 
-    # Step 4: Resize to 112x112 (ArcFace default)
-    cropped_face_resized = cv2.resize(cropped_face, (112, 112))
+    # Step 3b: Refuse unusable faces before paying for recognition
+    set_step("checking_quality")
+    quality = check_face_quality(img, face)
 
-    # Step 5: Save cropped face to disk
-    pic_full_name = str(uuid.uuid4())+"__"+profile_pic.filename
-    #str(uuid.uuid4()) + "__cropped.jpg"
+    # Step 4: Save profile picture to disk
+    set_step("saving")
+    pic_full_name = str(uuid.uuid4())+"__"+os.path.basename(filename or "profile.jpg")
     abs_profile_pic_path = os.path.join(abs_profile_pics_path, pic_full_name)
     with open(abs_profile_pic_path, "wb") as buffer:
-        buffer.write(await profile_pic.read())
+        buffer.write(img_bytes)
     profile_pic_path = os.path.join(profile_pics, pic_full_name)  # Relative for DB
 
-    #cv2.imwrite(abs_profile_pic_path, cropped_face_resized)
-
-    # Step 6: Extract and normalize embedding
+    # Step 5: Extract and normalize embedding
+    set_step("embedding")
+    embed_faces(face_app, img, [face])
     raw_embedding = face.embedding
     face_embedding = l2_normalize(raw_embedding)
 
-    # Step 7: Save user
-    user_id = get_unique_mongo_id()
+    # Step 6: Save user
     user_data = {
         "_id": user_id,
         "full_name": full_name,
         "email": email,
-        "password": pwd_context.hash(password),
+        "password": password_hash,
         "profile_pic": profile_pic_path,
         "t__created_at": datetime.datetime.now()
 
     }
-    db.users.insert_one(user_data)
+    db.users.replace_one({"_id": user_id}, user_data, upsert=True)
 
-    # Step 8: Save embedding
-    db.users_face_embeddings.insert_one({
+    # Step 7: Save embedding
+    embedding_doc = {
         "_id": user_id,
         "user_id": str(user_id),
         "face_embedding": face_embedding
-    })
+    }
+    if quality:
+        embedding_doc.update({"quality_score": quality["quality_score"], "quality_flags": quality["reasons"]})
+    db.users_face_embeddings.replace_one({"_id": user_id}, embedding_doc, upsert=True)
+    add_to_search_index(user_id, face_embedding)
 
     return {
         "message": "User registered successfully",
         "user_id": str(user_id),
         "email": email,
-        "profile_pic": profile_pic_path
+        "profile_pic": profile_pic_path,
+        "face_quality": quality
     }
+
+
+def _validate_registration(email, password, re_enter_password, profile_pic):
+    if password != re_enter_password:
+        raise HTTPException(status_code=400, detail="Passwords do not match")
+
+    existing_user = db.users.find_one({"email": email})
+    if existing_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+
+    if not profile_pic:
+        raise HTTPException(status_code=400, detail="Profile picture is required")
+
+
+@router.post("/register")
+async def register_user(
+        full_name: str = Form(...),
+        email: EmailStr = Form(...),
+        password: str = Form(..., min_length=6),
+        re_enter_password: str = Form(..., min_length=6, alias="re_enter_password"),
+        profile_pic: UploadFile = File(None)
+):
+    _validate_registration(email, password, re_enter_password, profile_pic)
+    img_bytes = await profile_pic.read()
+    password_hash = await run_blocking(pwd_context.hash, password)
+    return await run_blocking(create_user_with_face, full_name, email, password_hash, img_bytes, profile_pic.filename)
+
+
+def _registered_user_result(user_id):
+    """The job result of a registration that already completed, rebuilt from its documents."""
+    user = db.users.find_one({"_id": user_id}, {"email": 1, "profile_pic": 1})
+    embedding_doc = db.users_face_embeddings.find_one({"_id": user_id}, {"quality_score": 1, "quality_flags": 1})
+    if user is None or embedding_doc is None:
+        return None
+    quality = None
+    if "quality_score" in embedding_doc:
+        quality = {"quality_score": embedding_doc["quality_score"], "reasons": embedding_doc.get("quality_flags", [])}
+    return {
+        "message": "User registered successfully",
+        "user_id": str(user_id),
+        "email": user["email"],
+        "profile_pic": user["profile_pic"],
+        "face_quality": quality
+    }
+
+
+def _run_registration_job(payload, set_step):
+    upload_path = os.path.join(STATIC_FOLDER_PATH, payload["upload_path"])
+    try:
+        with open(upload_path, "rb") as f:
+            img_bytes = f.read()
+    except FileNotFoundError:
+        # The upload is only removed once the job is finished; if it went missing anyway, a
+        # user created by an earlier attempt is still the result
+        result = _registered_user_result(payload["user_id"])
+        if result is None:
+            raise HTTPException(status_code=410, detail="Uploaded picture is no longer available, please register again")
+        return result
+    return create_user_with_face(payload["full_name"], payload["email"], payload["password_hash"], img_bytes,
+                                 payload["filename"], user_id=payload["user_id"], set_step=set_step)
+
+
+def _remove_registration_upload(payload):
+    """Runs once the job succeeded, was rejected or was abandoned; retries keep the upload."""
+    try:
+        os.remove(os.path.join(STATIC_FOLDER_PATH, payload["upload_path"]))
+    except FileNotFoundError:
+        pass
+
+
+# Registration jobs share the inference cap with the request routes
+job_queue.register_handler("register", _run_registration_job,
+                           limiter=inference_limiter if ADMISSION_ENABLED else None,
+                           cleanup=_remove_registration_upload)
+
+
+def _job_response(job):
+    return {
+        "job_id": job["_id"],
+        "status": job["status"],
+        "step": job.get("step"),
+        "attempts": job.get("attempts", 0),
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "t__created_at": job.get("t__created_at"),
+        "t__updated_at": job.get("t__updated_at")
+    }
+
+
+@router.post("/register/jobs", status_code=202)
+async def submit_registration_job(
+        full_name: str = Form(...),
+        email: EmailStr = Form(...),
+        password: str = Form(..., min_length=6),
+        re_enter_password: str = Form(..., min_length=6, alias="re_enter_password"),
+        profile_pic: UploadFile = File(None),
+        idempotency_key: str = Header(None, alias="Idempotency-Key", max_length=128)
+):
+    """
+    Asynchronous registration: stores the upload, queues a job and returns its id right away.
+    Poll `GET /api/v1/register/jobs/{job_id}` for progress and the registration result.
+    Retries with the same `Idempotency-Key` header return the original job instead of a new one.
+    """
+    if idempotency_key:
+        job = job_queue.collection.find_one({"idempotency_key": f"register:{idempotency_key}"}, {"payload": 0})
+        if job:
+            return _job_response(job)
+
+    _validate_registration(email, password, re_enter_password, profile_pic)
+
+    password_hash = await run_blocking(pwd_context.hash, password)
+    upload_name = str(uuid.uuid4()) + "__" + os.path.basename(profile_pic.filename or "profile.jpg")
+    with open(os.path.join(abs_registration_uploads_path, upload_name), "wb") as buffer:
+        buffer.write(await profile_pic.read())
+
+    job, created = job_queue.submit("register", {
+        "user_id": get_unique_mongo_id(),
+        "full_name": full_name,
+        "email": email,
+        "password_hash": password_hash,
+        "upload_path": os.path.join(registration_uploads, upload_name),
+        "filename": profile_pic.filename
+    }, idempotency_key=idempotency_key)
+    if not created:
+        # Lost a race with a concurrent retry of the same request
+        os.remove(os.path.join(abs_registration_uploads_path, upload_name))
+    return _job_response(job)
+
+
+@router.get("/register/jobs/{job_id}")
+async def get_registration_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None or job.get("kind") != "register":
+        raise HTTPException(status_code=404, detail="Registration job not found")
+    return _job_response(job)
@@ -1,9 +1,19 @@
+import datetime
+import json
+
 import cv2
+import jwt
 import numpy as np
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
+from cdots.core.config import SECRET_KEY, ALGORITHM, SIMILAR_MEMBERS_CURSOR_TTL_S, SIMILAR_MEMBERS_MAX_RESULTS
 from cdots.db.mongo.mongo_connection import MongoDBConnection
-from cdots.core.face_analysis import FaceAppSingleton
+from cdots.core.face_analysis import FaceAppSingleton, detect_faces, embed_faces
+from cdots.core.face_quality import check_face_quality
+from cdots.core.face_search import SearchIndexSingleton, uses_search_index, similarity_pipeline
 from cdots.apis.auth.utils import get_current_user
+from cdots.core.profiling import traced_iterator
+from cdots.core.utils import get_unique_mongo_id, run_blocking
 import uuid
 import os
 
@@ -16,30 +26,116 @@ db = db_connection.get_db()
 # Shared face analysis instance
 face_app = FaceAppSingleton.get_instance()
 
+# Query embeddings behind continuation cursors, removed by Mongo once the cursor has expired
+db.similarity_queries.create_index("t__created_at", expireAfterSeconds=int(SIMILAR_MEMBERS_CURSOR_TTL_S))
+
+HYDRATE_BATCH_SIZE = 10
+
 # Helper function to normalize embedding
 def l2_normalize(vec):
     vec = np.array(vec)
     norm_val = np.linalg.norm(vec)
     return (vec / norm_val).tolist() if norm_val != 0 else vec.tolist()
 
-@router.post("/fetch-similar-members-by-pic")
-async def fetch_similar_members_by_pic(
-        profile_pic: UploadFile = File(...),
-        current_user: dict = Depends(get_current_user)):
-    """
-    Uploads a picture, crops and aligns the face, extracts embedding, and finds the top 100 matches.
-    """
 
-    # Step 1: Read and decode image
-    contents = await profile_pic.read()
+def search_matches(face_embedding, offset, page_size):
+    """Matches ranked `offset` to `offset + page_size`, plus whether more may follow."""
+    limit = min(offset + page_size, SIMILAR_MEMBERS_MAX_RESULTS)
+    if uses_search_index():
+        matches = SearchIndexSingleton.get_instance().search(face_embedding, limit=limit, min_percentage=30)
+    else:
+        matches = list(db.users_face_embeddings.aggregate(similarity_pipeline(face_embedding, limit=limit)))
+    return matches[offset:], len(matches) == limit and limit < SIMILAR_MEMBERS_MAX_RESULTS
+
+
+def hydrate_matches(matches):
+    """Yields matched users with their family trees in rank order, fetched a few users per query."""
+    for start in range(0, len(matches), HYDRATE_BATCH_SIZE):
+        batch = matches[start:start + HYDRATE_BATCH_SIZE]
+        user_ids = [match["user_id"] for match in batch]
+        users = {u["_id"]: u for u in db.users.find({"_id": {"$in": user_ids}},
+                                                     {"full_name": 1, "email": 1, "profile_pic": 1})}
+        user_family_trees = {}
+        for tree in db.family_trees.find({"created_by": {"$in": list(users)}}, {"tree_name": 1, "created_by": 1}):
+            user_family_trees.setdefault(tree["created_by"], []).append({"tree_name": tree["tree_name"]})
+
+        for match in batch:
+            user = users.get(match["user_id"])
+            if user:
+                yield {
+                    "user_id": str(user["_id"]),
+                    "full_name": user.get("full_name"),
+                    "email": user.get("email"),
+                    "profile_pic": user.get("profile_pic"),
+                    "match_percentage": round(match["match_percentage"], 2),
+                    "family_trees": user_family_trees.get(user["_id"], [])  # include family trees here
+                }
+
+
+def encode_cursor(query_id, user_id, offset, page_size):
+    payload = {
+        "qid": query_id,
+        "user_id": user_id,
+        "offset": offset,
+        "page_size": page_size,
+        "exp": datetime.datetime.utcnow() + datetime.timedelta(seconds=SIMILAR_MEMBERS_CURSOR_TTL_S)
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_cursor(cursor, user_id):
+    try:
+        payload = jwt.decode(cursor, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=410, detail="Cursor has expired, search again")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if payload.get("user_id") != user_id:
+        raise HTTPException(status_code=403, detail="Cursor belongs to another user")
+    return payload
+
+
+def similar_members_response(face_embedding, query_id, user_id, offset, page_size, stream, face_quality=None):
+    matches, has_more = search_matches(face_embedding, offset, page_size)
+    next_cursor = None
+    if has_more:
+        if query_id is None:
+            # Keep the query embedding so later pages skip detection and embedding
+            query_id = get_unique_mongo_id()
+            db.similarity_queries.insert_one({"_id": query_id, "user_id": user_id,
+                                              "face_embedding": face_embedding,
+                                              "t__created_at": datetime.datetime.utcnow()})
+        next_cursor = encode_cursor(query_id, user_id, offset + page_size, page_size)
+
+    if stream:
+        def ndjson():
+            for matched_user in hydrate_matches(matches):
+                yield json.dumps(matched_user) + "\n"
+            yield json.dumps({"message": "Face recognition completed", "next_cursor": next_cursor,
+                              "face_quality": face_quality}) + "\n"
+
+        return StreamingResponse(traced_iterator(ndjson()), media_type="application/x-ndjson")
+
+    return {
+        "message": "Face recognition completed",
+        "matched_users": list(hydrate_matches(matches)),
+        "next_cursor": next_cursor,
+        "face_quality": face_quality
+    }
+
+
+def extract_query_embedding(contents):
+    """Decodes the uploaded picture, picks the largest face and returns its normalized embedding and quality."""
+
+    # Step 1: Decode image
     nparr = np.frombuffer(contents, np.uint8)
     img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
 
     if img is None:
         raise HTTPException(status_code=400, detail="Invalid image format")
 
-    # Step 2: Detect faces
-    detected_faces = face_app.get(img)
+    # Step 2: Detect faces (recognition runs later, for the selected face only)
+    detected_faces = detect_faces(face_app, img)
     if not detected_faces:
         raise HTTPException(status_code=400, detail="No face detected in the image")
 
@@ -59,59 +155,60 @@ async def fetch_similar_members_by_pic(
     debug_path = f"/mnt/git/cdots/{uuid.uuid4()}__debug_face.jpg"
     cv2.imwrite(debug_path, cropped_face_resized)
 
-    # Step 5: Extract and normalize face embedding
+    # Step 5: Check face quality, then extract and normalize face embedding
+    quality = check_face_quality(img, face)
+    embed_faces(face_app, img, [face])
     raw_embedding = face.embedding
-    face_embedding = l2_normalize(raw_embedding)
-
-    # Step 6: Build cosine similarity pipeline
-    pipeline = [
-        {
-            "$project": {
-                "user_id": 1,
-                "face_embedding": 1,
-                "dot_product": {
-                    "$sum": [
-                        {"$multiply": [{"$arrayElemAt": ["$face_embedding", i]}, face_embedding[i]]}
-                        for i in range(512)
-                    ]
-                }
-            }
-        },
-        {
-            "$addFields": {
-                "match_percentage": { "$multiply": ["$dot_product", 100] }
-            }
-        },
-        {
-            "$match": {
-                "match_percentage": {"$gt": 30}  #  Only include scores > 60
-            }
-        },
-        { "$sort": { "match_percentage": -1 } },
-        { "$limit": 100 }
-    ]
-
-    matches = list(db.users_face_embeddings.aggregate(pipeline))
-
-    # Step 7: Fetch matched user info from `users` collection
-    matched_users = []
-    for match in matches:
-        user = db.users.find_one({"_id": match["user_id"]}, {"full_name": 1, "email": 1, "profile_pic": 1})
-        if user:
-            # Get all family trees for this user
-            trees = db.family_trees.find({"created_by": str(user["_id"])}, {"tree_name": 1})
-            user_family_trees = [{"tree_name": t["tree_name"]} for t in trees]
-
-            matched_users.append({
-                "user_id": str(user["_id"]),
-                "full_name": user.get("full_name"),
-                "email": user.get("email"),
-                "profile_pic": user.get("profile_pic"),
-                "match_percentage": round(match["match_percentage"], 2),
-                "family_trees": user_family_trees  # include family trees here
-            })
+    return l2_normalize(raw_embedding), quality
+
+
+@router.post("/fetch-similar-members-by-pic")
+async def fetch_similar_members_by_pic(
+        profile_pic: UploadFile = File(...),
+        page_size: int = Query(100, ge=1, le=100),
+        stream: bool = Query(False, description="Send matches as NDJSON lines in rank order as they are fetched"),
+        current_user: dict = Depends(get_current_user)):
+    """
+    Uploads a picture, crops and aligns the face, extracts embedding, and finds the top 100 matches.
+    """
+    contents = await profile_pic.read()
+    # Detection, embedding and search run in the threadpool, off the event loop
+    face_embedding, quality = await run_blocking(extract_query_embedding, contents)
+
+    # Step 6: Search by cosine similarity and fetch matched user info from `users` collection
+    return await run_blocking(similar_members_response, face_embedding, None, current_user["user_id"], 0,
+                              page_size, stream, face_quality=quality)
+
+
+@router.get("/fetch-similar-members-by-pic/next")
+async def fetch_similar_members_next_page(
+        cursor: str,
+        stream: bool = Query(False, description="Send matches as NDJSON lines in rank order as they are fetched"),
+        current_user: dict = Depends(get_current_user)):
+    """
+    Next page of a similar member search, using the `next_cursor` of the previous page.
+    Reuses the stored query embedding, so no upload, detection or embedding is needed.
+    """
+    payload = decode_cursor(cursor, current_user["user_id"])
+    query = db.similarity_queries.find_one({"_id": payload["qid"]}, {"face_embedding": 1})
+    if query is None:
+        raise HTTPException(status_code=410, detail="Cursor has expired, search again")
+    return await run_blocking(similar_members_response, query["face_embedding"], payload["qid"],
+                              current_user["user_id"], payload["offset"], payload["page_size"], stream)
+
+
+@router.get("/similar-members/{user_id}")
+async def get_precomputed_similar_members(user_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Returns the precomputed most similar members for a registered user, kept up to date by
+    `python -m scripts.update_neighbour_lists --watch`. No upload or face detection needed.
+    """
+    doc = db.user_similar_members.find_one({"_id": user_id})
+    if doc is None:
+        raise HTTPException(status_code=404, detail="No similar members computed for this user yet")
 
     return {
-        "message": "Face recognition completed",
-        "matched_users": matched_users
+        "user_id": user_id,
+        "matched_users": doc.get("neighbours", []),
+        "t__updated_at": doc.get("t__updated_at")
     }
@@ -0,0 +1,138 @@
+import datetime
+import os
+import uuid
+
+import cv2
+import numpy as np
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+
+from cdots.apis.auth.utils import get_current_user
+from cdots.core.config import STATIC_FOLDER_PATH, FACE_QUALITY_MODE
+from cdots.core.face_analysis import FaceAppSingleton, detect_faces, embed_faces
+from cdots.core.face_quality import assess_face, is_rejected
+from cdots.core.face_search import search_similar_many
+from cdots.core.utils import get_unique_mongo_id, run_blocking
+from cdots.db.mongo.mongo_connection import MongoDBConnection
+
+router = APIRouter(prefix="/api/v1", tags=["Member Operations"])
+
+db_connection = MongoDBConnection()
+db = db_connection.get_db()
+
+face_app = FaceAppSingleton.get_instance()
+
+group_photos = "group_photos"
+abs_group_photos_path = os.path.join(STATIC_FOLDER_PATH, group_photos)
+os.makedirs(abs_group_photos_path, exist_ok=True)
+
+MAX_FACES_PER_PHOTO = 50
+
+
+def l2_normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def detect_and_embed(img):
+    """
+    Detects all faces, checks their quality and embeds the usable ones in one batch.
+    Returns the faces (left to right), their quality and the normalized embedding per usable face index.
+    """
+    faces = detect_faces(face_app, img, max_num=MAX_FACES_PER_PHOTO)
+    if not faces:
+        raise HTTPException(status_code=400, detail="No face detected in the image")
+    faces.sort(key=lambda f: (f.bbox[0], f.bbox[1]))  # left to right
+    if FACE_QUALITY_MODE == "off":
+        qualities = [{"quality_score": round(float(face.det_score), 4), "reasons": []} for face in faces]
+    else:
+        qualities = [assess_face(img, face) for face in faces]
+    accepted = [i for i, quality in enumerate(qualities) if not is_rejected(quality)]
+    embed_faces(face_app, img, [faces[i] for i in accepted])
+    embeddings = l2_normalize_rows([faces[i].embedding for i in accepted]) if accepted else []
+    return faces, qualities, dict(zip(accepted, embeddings))
+
+
+@router.post("/index-group-photo")
+async def index_group_photo(
+        photo: UploadFile = File(...),
+        current_user: dict = Depends(get_current_user)):
+    """
+    Indexes every face of a group photo and returns similar members for each of them.
+    Detection runs once for the whole photo and recognition once for all usable faces as a
+    batch; faces failing the quality checks are stored with their reasons but not embedded.
+    Faces are stored in `photo_faces` with their bbox and scores, linked to `group_photos`.
+    """
+
+    # Step 1: Read and decode image
+    contents = await photo.read()
+    img = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise HTTPException(status_code=400, detail="Invalid image format")
+
+    # Step 2: Detect all faces, check their quality, then embed the usable ones in one batch (off the event loop)
+    faces, qualities, embedding_of = await run_blocking(detect_and_embed, img)
+
+    # Step 3: Save the photo and its faces
+    photo_id = get_unique_mongo_id()
+    pic_full_name = str(uuid.uuid4()) + "__" + os.path.basename(photo.filename or "photo.jpg")
+    with open(os.path.join(abs_group_photos_path, pic_full_name), "wb") as buffer:
+        buffer.write(contents)
+    now = datetime.datetime.now()
+    db.group_photos.insert_one({
+        "_id": photo_id,
+        "uploaded_by": current_user["user_id"],
+        "photo": os.path.join(group_photos, pic_full_name),
+        "width": int(img.shape[1]),
+        "height": int(img.shape[0]),
+        "face_count": len(faces),
+        "t__created_at": now
+    })
+    face_docs = [{
+        "_id": get_unique_mongo_id(),
+        "photo_id": photo_id,
+        "face_index": face_index,
+        "bbox": [round(float(v), 1) for v in face.bbox[:4]],
+        "det_score": round(float(face.det_score), 4),
+        "quality_score": quality["quality_score"],
+        "quality_flags": quality["reasons"],
+        "rejected": face_index not in embedding_of,
+        "face_embedding": embedding_of[face_index].tolist() if face_index in embedding_of else None,
+        "t__created_at": now
+    } for face_index, (face, quality) in enumerate(zip(faces, qualities))]
+    db.photo_faces.insert_many(face_docs)
+
+    # Step 4: One batched similarity query for all usable faces
+    matches_per_face = [[] for _ in faces]
+    if embedding_of:
+        accepted = list(embedding_of)
+        matches = await run_blocking(search_similar_many, db, [embedding_of[i].tolist() for i in accepted],
+                                     limit=100, min_percentage=30)
+        for i, face_matches in zip(accepted, matches):
+            matches_per_face[i] = face_matches
+
+    # Step 5: Fetch every matched user with a single query
+    matched_ids = {match["user_id"] for matches in matches_per_face for match in matches}
+    users = {u["_id"]: u for u in db.users.find({"_id": {"$in": list(matched_ids)}},
+                                                 {"full_name": 1, "email": 1, "profile_pic": 1})}
+
+    return {
+        "message": "Group photo indexed",
+        "photo_id": photo_id,
+        "faces": [{
+            "face_id": face_doc["_id"],
+            "face_index": face_doc["face_index"],
+            "bbox": face_doc["bbox"],
+            "det_score": face_doc["det_score"],
+            "quality_score": face_doc["quality_score"],
+            "quality_flags": face_doc["quality_flags"],
+            "rejected": face_doc["rejected"],
+            "matched_users": [{
+                "user_id": match["user_id"],
+                "full_name": users[match["user_id"]].get("full_name"),
+                "email": users[match["user_id"]].get("email"),
+                "profile_pic": users[match["user_id"]].get("profile_pic"),
+                "match_percentage": round(match["match_percentage"], 2)
+            } for match in matches if match["user_id"] in users]
+        } for face_doc, matches in zip(face_docs, matches_per_face)]
+    }
@@ -0,0 +1,141 @@
+import asyncio
+import collections
+import math
+import time
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from cdots.core.config import ADMISSION_ENABLED, ADMISSION_ROUTES, ADMISSION_INFERENCE_CONCURRENCY
+from cdots.core.logging_config import get_logger
+
+logger = get_logger()
+
+# Routes that run face detection / recognition or a full similarity search. Everything else (login, /me, tree edits)
+# is never queued, so it keeps being served while inference is saturated.
+DEFAULT_ROUTE_LIMITS = {
+    "/api/v1/register": {"concurrency": 2, "queue": 16, "max_wait_ms": 15000},
+    "/api/v1/fetch-similar-members-by-pic": {"concurrency": 2, "queue": 32, "max_wait_ms": 10000},
+    # Paging re-runs the search with a larger limit (the full aggregation on the Mongo backend)
+    "/api/v1/fetch-similar-members-by-pic/next": {"concurrency": 2, "queue": 32, "max_wait_ms": 10000},
+    "/api/v1/index-group-photo": {"concurrency": 1, "queue": 8, "max_wait_ms": 20000},
+    "/upload/": {"concurrency": 1, "queue": 8, "max_wait_ms": 15000},
+}
+
+
+class Overloaded(Exception):
+    def __init__(self, limiter, retry_after):
+        super().__init__(f"{limiter} overloaded")
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """
+    Concurrency limit with a bounded FIFO wait queue. A request is rejected up front when
+    the queue is full or when the expected wait (queue position x average service time)
+    already exceeds its deadline, and rejected when it is still queued at its deadline.
+    """
+
+    def __init__(self, name, concurrency, queue, max_wait_ms):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue
+        self.max_wait_s = max_wait_ms / 1000.0
+        self.active = 0
+        self.waiters = collections.deque()
+        self.avg_service_s = None
+
+    def estimated_wait(self, position=None):
+        if self.active < self.concurrency:
+            return 0.0
+        position = len(self.waiters) if position is None else position
+        return (position // self.concurrency + 1) * (self.avg_service_s or 0.0)
+
+    def retry_after(self):
+        return max(1, math.ceil(self.estimated_wait()))
+
+    async def acquire(self, deadline):
+        loop = asyncio.get_running_loop()
+        if self.active < self.concurrency and not self.waiters:
+            self.active += 1
+            return
+        if len(self.waiters) >= self.queue_size:
+            raise Overloaded(self.name, self.retry_after())
+        remaining = deadline - loop.time()
+        if self.estimated_wait() > remaining:
+            raise Overloaded(self.name, self.retry_after())
+
+        fut = loop.create_future()
+        self.waiters.append(fut)
+        try:
+            await asyncio.wait_for(fut, remaining)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                # The slot was handed over just as we gave up, pass it on
+                self._hand_off()
+            elif fut in self.waiters:
+                self.waiters.remove(fut)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise Overloaded(self.name, self.retry_after())
+
+    def release(self, service_s=None):
+        if service_s is not None:
+            self.avg_service_s = service_s if self.avg_service_s is None else 0.8 * self.avg_service_s + 0.2 * service_s
+        self._hand_off()
+
+    def _hand_off(self):
+        while self.waiters:
+            fut = self.waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+
+def _build_limiters():
+    limits = {path: dict(limit) for path, limit in DEFAULT_ROUTE_LIMITS.items()}
+    for path, limit in ADMISSION_ROUTES.items():
+        limits.setdefault(path, {"concurrency": 1, "queue": 8, "max_wait_ms": 15000}).update(limit)
+    return {path: ConcurrencyLimiter(path, **limit) for path, limit in limits.items()}
+
+
+route_limiters = _build_limiters()
+# All limited routes compete for the same CPU, cap their total as well
+inference_limiter = ConcurrencyLimiter("inference", ADMISSION_INFERENCE_CONCURRENCY, queue=1 << 16, max_wait_ms=0)
+
+
+async def admission_control_middleware(request: Request, call_next):
+    """
+    HTTP middleware that admits inference-heavy requests through per-route limiters and
+    answers 503 with `Retry-After` instead of queueing them without bound.
+    """
+    limiter = route_limiters.get(request.url.path) if ADMISSION_ENABLED else None
+    if limiter is None:
+        return await call_next(request)
+
+    deadline = asyncio.get_running_loop().time() + limiter.max_wait_s
+    acquired = []
+    try:
+        for l in (limiter, inference_limiter):
+            await l.acquire(deadline)
+            acquired.append(l)
+    except Overloaded as e:
+        for l in acquired:
+            l.release()
+        logger.warning(f"request rejected by admission control, info:{{'path': '{request.url.path}', "
+                       f"'limiter': '{e}', 'retry_after': {e.retry_after}}}")
+        return JSONResponse(status_code=503, content={"detail": "Server is busy, please retry later."},
+                            headers={"Retry-After": str(e.retry_after)})
+    except asyncio.CancelledError:
+        for l in acquired:
+            l.release()
+        raise
+
+    start = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        service_s = time.perf_counter() - start
+        for l in reversed(acquired):
+            l.release(service_s)
@@ -21,13 +21,96 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # MongoDB settings
 MONGO_URI = config.get("mongo_uri", "mongodb://localhost:27017/")
 MONGO_DB_NAME = config.get("mongo_db_name", "cdots")
+MONGO_BACKEND = config.get("mongo_backend", "pymongo")  # "pymongo" or "mongomock" (in-process, for benchmarks)
 LOGS_FOLDER = config.get("logs_folder", "")
 try:
     STATIC_FOLDER_PATH = config['static_folder']
 except Exception as e:
     raise Exception(f"configuration file missing static_folder path, error_info:{e}")
 
+# Face model: "buffalo_l" (insightface) or "fake" (deterministic stand-in, see cdots/core/fake_face_analysis.py)
+FACE_MODEL = config.get("face_model", "buffalo_l")
+# Only detection and recognition are used by the APIs; skipping landmark/genderage models saves memory per worker
+FACE_MODEL_MODULES = config.get("face_model_modules", ["detection", "recognition"])
+# onnxruntime intra-op threads per session (0 = onnxruntime default). Use 1 with multi-worker preload.
+FACE_MODEL_THREADS = int(config.get("face_model_threads", 0))
+# Faces the fake model reports per image, > 1 to exercise the group photo endpoint offline
+FAKE_FACES_PER_IMAGE = int(config.get("fake_faces_per_image", 1))
+
+# Similar member search: "mongo" (aggregation pipeline), "memory" (in-process embedding index)
+# or "sharded" (index split across local search processes, see cdots/core/sharded_search.py)
+FACE_SEARCH_BACKEND = config.get("face_search_backend", "mongo")
+# Shard processes per app worker: every gunicorn worker starts its own set and holds a full copy
+# of the index across them, so keep workers * shards within the CPU count
+FACE_SEARCH_SHARDS = int(config.get("face_search_shards", 2))
+# Shards that do not answer in time are left out of the result
+FACE_SEARCH_SHARD_TIMEOUT_MS = float(config.get("face_search_shard_timeout_ms", 2000))
+# Two-stage search for the "memory" backend: candidate pass in a PCA-reduced space (projection
+# fitted by `python -m scripts.fit_pca_projection`), then exact 512-d rerank of the best candidates
+FACE_SEARCH_PCA_PATH = config.get("face_search_pca_path", "")
+FACE_SEARCH_PCA_CANDIDATES = int(config.get("face_search_pca_candidates", 300))
+# Incremental sync of the in-memory index from `users_face_embeddings` (see cdots/core/index_sync.py).
+# Change streams are used when Mongo runs as a replica set, otherwise `_id` watermark polling every
+# `embedding_index_refresh_s` plus a full id reconcile for deletes every `embedding_index_reconcile_s`.
+EMBEDDING_INDEX_REFRESH_S = float(config.get("embedding_index_refresh_s", 5))
+EMBEDDING_INDEX_RECONCILE_S = float(config.get("embedding_index_reconcile_s", 300))
+EMBEDDING_INDEX_SYNC_BATCH = int(config.get("embedding_index_sync_batch", 500))
+EMBEDDING_INDEX_MAX_LAG_S = float(config.get("embedding_index_max_lag_s", 30))
+
 # Define upload folder
 os.makedirs(STATIC_FOLDER_PATH, exist_ok=True)
 
 
+
+# Admission control for inference-heavy routes (see cdots/core/admission.py)
+ADMISSION_ENABLED = config.get("admission_enabled", True)
+# Per-route overrides, e.g. {"/api/v1/register": {"concurrency": 4, "queue": 32, "max_wait_ms": 10000}}
+ADMISSION_ROUTES = config.get("admission_routes", {})
+# Total inference requests in flight per worker across all limited routes
+ADMISSION_INFERENCE_CONCURRENCY = int(config.get("admission_inference_concurrency", 2))
+
+# Request profiler settings (opt-in, see cdots/core/profiling.py)
+PROFILER_ENABLED = config.get("profiler_enabled", False)
+PROFILER_MODE = config.get("profiler_mode", "sample")  # "sample" (collapsed stacks) or "cprofile" (pstats)
+PROFILER_SAMPLE_RATE = float(config.get("profiler_sample_rate", 0.0))
+PROFILER_ADMIN_TOKEN = config.get("profiler_admin_token", "")
+PROFILER_INTERVAL_MS = float(config.get("profiler_interval_ms", 5))
+PROFILER_MAX_PER_MINUTE = int(config.get("profiler_max_per_minute", 6))
+
+# Precomputed similar member lists (see cdots/core/neighbour_lists.py)
+NEIGHBOUR_LIST_K = int(config.get("neighbour_list_k", 20))
+NEIGHBOUR_LIST_POLL_S = float(config.get("neighbour_list_poll_s", 10))
+# Full pass over the embeddings for deleted or replaced faces, which polling for new ids misses
+NEIGHBOUR_LIST_RECONCILE_S = float(config.get("neighbour_list_reconcile_s", 3600))
+
+# Legacy `/upload/` person store: fold its append-only journal into the JSON file past this size
+PERSON_STORE_COMPACT_BYTES = int(config.get("person_store_compact_bytes", 8 * 1024 * 1024))
+
+# Background jobs, e.g. asynchronous registration (see cdots/core/job_queue.py)
+JOB_WORKERS = int(config.get("job_workers", 1))  # worker threads per app process
+JOB_POLL_S = float(config.get("job_poll_s", 1))
+JOB_LEASE_S = float(config.get("job_lease_s", 120))  # a claimed job is retried if not finished within this
+JOB_MAX_ATTEMPTS = int(config.get("job_max_attempts", 3))
+JOB_RETENTION_S = float(config.get("job_retention_s", 7 * 24 * 3600))  # finished jobs are deleted after this
+
+# Similar member search paging: continuation cursors stay valid this long, and pages stop after this many matches
+SIMILAR_MEMBERS_CURSOR_TTL_S = float(config.get("similar_members_cursor_ttl_s", 900))
+SIMILAR_MEMBERS_MAX_RESULTS = int(config.get("similar_members_max_results", 1000))
+
+# Face quality gate between detection and recognition (see cdots/core/face_quality.py):
+# "reject" refuses unusable faces before embedding them, "flag" only stores the quality, "off" skips the checks.
+# Defaults to "flag": the thresholds below are not yet calibrated on our uploads. Measure them with
+# `python -m scripts.calibrate_face_quality <photo folder>` on a sample of real profile pictures before rejecting.
+FACE_QUALITY_MODE = config.get("face_quality_mode", "flag")
+# Threshold provenance (none of these is fitted to our data yet):
+# - det_score 0.5: insightface's own det_thresh, so at the default it only matters with a lower det_thresh
+# - 32px: below it the 112px ArcFace crop is upscaled more than 3.5x
+# - yaw 0.45: nose offset / eye distance of the 5-point landmarks, ~40 degrees on the ArcFace template geometry
+# - pitch 0.2-0.8: nose between the eye and mouth lines, ~0.5 when frontal on the same template
+# - sharpness 30: Laplacian variance of the 112px grey crop, a starting guess and the least certain of the
+#   five: it depends on camera, JPEG quality and lighting
+FACE_QUALITY_MIN_DET_SCORE = float(config.get("face_quality_min_det_score", 0.5))
+FACE_QUALITY_MIN_FACE_PX = float(config.get("face_quality_min_face_px", 32))  # shorter bbox side
+FACE_QUALITY_MAX_YAW = float(config.get("face_quality_max_yaw", 0.45))  # ~40 degrees
+FACE_QUALITY_PITCH_RANGE = config.get("face_quality_pitch_range", [0.2, 0.8])
+FACE_QUALITY_MIN_SHARPNESS = float(config.get("face_quality_min_sharpness", 30))  # Laplacian variance at 112px
@@ -0,0 +1,299 @@
+import collections
+import threading
+
+import numpy as np
+from bson import ObjectId
+
+from cdots.core.logging_config import get_logger
+
+logger = get_logger()
+
+EMBEDDING_SIZE = 512
+# Fold the per-worker delta into the base matrix once it grows past this many rows
+COMPACT_MIN_ROWS = 10000
+
+
+def id_time(doc_id):
+    try:
+        return ObjectId(doc_id).generation_time
+    except Exception:
+        return None
+
+
+def load_embeddings(db):
+    """
+    Reads `users_face_embeddings` into a list of user ids and a float32 (N, 512) matrix,
+    sorted by user id so the row order does not depend on the collection's natural order.
+    """
+    docs = []
+    for doc in db.users_face_embeddings.find({}, {"user_id": 1, "face_embedding": 1}):
+        embedding = doc.get("face_embedding")
+        if embedding and len(embedding) == EMBEDDING_SIZE:
+            docs.append((str(doc["user_id"]), embedding))
+    docs.sort(key=lambda doc: doc[0])
+    ids = [user_id for user_id, _ in docs]
+    matrix = np.array([embedding for _, embedding in docs], dtype=np.float32).reshape(len(docs), EMBEDDING_SIZE)
+    logger.info(f"embeddings loaded, info:{{'embeddings': {len(ids)}, 'bytes': {matrix.nbytes}}}")
+    return ids, matrix
+
+
+def top_matches(scores, limit, min_percentage):
+    """Positions of the best `limit` scores above `min_percentage`, best first."""
+    candidates = np.flatnonzero(scores > min_percentage)
+    if len(candidates) > limit:
+        candidates = candidates[np.argpartition(-scores[candidates], limit)[:limit]]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+class RowStore:
+    """Embeddings keyed by user id in a capacity-doubling matrix, with in-place update and removal."""
+
+    def __init__(self, capacity=1024):
+        self.ids = []
+        self.positions = {}
+        self.matrix = np.empty((capacity, EMBEDDING_SIZE), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows(self):
+        return self.matrix[:len(self.ids)]
+
+    def copy(self):
+        store = RowStore.__new__(RowStore)
+        store.ids = list(self.ids)
+        store.positions = dict(self.positions)
+        store.matrix = self.matrix.copy()
+        return store
+
+    def upsert(self, ids, rows):
+        for user_id, row in zip(ids, rows):
+            position = self.positions.get(user_id)
+            if position is None:
+                position = len(self.ids)
+                if position == len(self.matrix):
+                    self.matrix = np.concatenate([self.matrix, np.empty_like(self.matrix)])
+                self.ids.append(user_id)
+                self.positions[user_id] = position
+            self.matrix[position] = row
+
+    def take(self, mask):
+        """Removes the rows selected by `mask` and returns them as (ids, rows)."""
+        count = len(self.ids)
+        taken = np.flatnonzero(mask)
+        ids, rows = [self.ids[i] for i in taken], self.matrix[taken].copy()
+        kept = np.flatnonzero(~mask)
+        self.ids = [self.ids[i] for i in kept]
+        self.matrix[:len(kept)] = self.matrix[:count][kept]
+        self.positions = {user_id: i for i, user_id in enumerate(self.ids)}
+        return ids, rows
+
+    def remove(self, user_ids):
+        user_ids = set(user_ids)
+        return self.take(np.array([i in user_ids for i in self.ids], dtype=bool))[0]
+
+    def search(self, query, limit, min_percentage):
+        scores = self.rows() @ query * 100
+        return [(self.ids[i], float(scores[i])) for i in top_matches(scores, limit, min_percentage)]
+
+
+class BaseSearchIndex:
+    """
+    Base for in-memory search indexes: tracks which user ids are present and the newest
+    inserted `_id` seen, which is where incremental sync (cdots/core/index_sync.py) resumes.
+    Subclasses implement `_upsert_many(ids, rows, existing)`, `_delete(ids)` and `search(...)`.
+    """
+
+    def __init__(self, ids):
+        self._known = set(ids)
+        self._known_lock = threading.Lock()
+        self.watermark = max(filter(None, map(id_time, ids)), default=None)
+
+    def __contains__(self, user_id):
+        return str(user_id) in self._known
+
+    def ids(self):
+        with self._known_lock:
+            return set(self._known)
+
+    def add(self, user_id, embedding):
+        """Inserts an embedding unless the user is already indexed."""
+        if str(user_id) not in self._known:
+            self.upsert_many([user_id], [embedding])
+
+    def upsert_many(self, user_ids, embeddings):
+        ids, rows = [], []
+        for user_id, embedding in zip(user_ids, embeddings):
+            if embedding is not None and len(embedding) == EMBEDDING_SIZE:
+                ids.append(str(user_id))
+                rows.append(embedding)
+        if not ids:
+            return
+        with self._known_lock:
+            existing = [i for i in ids if i in self._known]
+            self._known.update(ids)
+        self._upsert_many(ids, np.asarray(rows, dtype=np.float32), existing)
+
+    def delete(self, user_ids):
+        user_ids = [str(i) for i in user_ids]
+        with self._known_lock:
+            self._known.difference_update(user_ids)
+        self._delete(user_ids)
+
+    def search_many(self, queries, limit=100, min_percentage=30):
+        """One result list per query; subclasses that can batch the scoring override this."""
+        return [self.search(query, limit, min_percentage) for query in queries]
+
+
+# What a search reads: replaced as a whole on every write, never modified after publishing.
+# `delta_ids` may grow past `len(delta_rows)` afterwards; only its first len(delta_rows) entries belong to it.
+_Snapshot = collections.namedtuple(
+    "_Snapshot", ["base_ids", "base_matrix", "base_projected", "tombstones", "delta_ids", "delta_rows"])
+
+
+class EmbeddingIndex(BaseSearchIndex):
+    """
+    In-memory copy of `users_face_embeddings` for similar member search.
+
+    The base matrix and id array are plain numpy buffers built once; when the app is
+    preloaded in a gunicorn master (see gunicorn_conf.py) every worker shares those pages
+    copy-on-write. Changes made afterwards are kept per worker: new and updated rows in a
+    small delta store, removed or replaced base rows in a tombstone mask.
+
+    Writers publish an immutable `_Snapshot` after each change and searches score whatever
+    snapshot they picked up, without locking or copying: appends go to delta rows no
+    snapshot covers yet, while updates, removals and tombstones copy the delta or mask first.
+
+    With a `projection` the base rows are also kept in PCA-reduced form and searched in
+    two stages: the reduced space picks `candidates` rows, exact 512-d scores rerank them.
+    """
+
+    def __init__(self, ids, matrix, projection=None, candidates=300):
+        super().__init__(ids)
+        self.base_ids = np.array(ids) if ids else np.array([], dtype="U24")
+        self.base_matrix = matrix
+        self.projection = projection
+        self.candidates = candidates
+        self.base_projected = projection.project(matrix) if projection is not None else None
+        self._base_positions = None
+        self._tombstones = None
+        self._delta = RowStore()
+        self._lock = threading.Lock()
+        self._publish()
+
+    @classmethod
+    def build(cls, db, projection=None, candidates=300):
+        return cls(*load_embeddings(db), projection=projection, candidates=candidates)
+
+    def __len__(self):
+        return len(self._known)
+
+    def _publish(self):
+        self._snapshot = _Snapshot(self.base_ids, self.base_matrix, self.base_projected, self._tombstones,
+                                   self._delta.ids, self._delta.rows())
+
+    def _tombstone_base(self, user_ids):
+        if self._base_positions is None:
+            # Built on the first update or delete only, so insert-only workers keep sharing the base pages
+            self._base_positions = {str(user_id): i for i, user_id in enumerate(self.base_ids)}
+        positions = [p for p in (self._base_positions.pop(user_id, None) for user_id in user_ids) if p is not None]
+        if positions:
+            tombstones = np.zeros(len(self.base_ids), dtype=bool) if self._tombstones is None else self._tombstones.copy()
+            tombstones[positions] = True
+            self._tombstones = tombstones
+
+    def _upsert_many(self, ids, rows, existing):
+        with self._lock:
+            self._tombstone_base(existing)
+            if any(user_id in self._delta.positions for user_id in ids):
+                # Updated rows are overwritten in place, which published snapshots must not see
+                self._delta = self._delta.copy()
+            self._delta.upsert(ids, rows)
+            if len(self._delta) > max(COMPACT_MIN_ROWS, len(self.base_ids) // 10):
+                self._compact()
+            self._publish()
+
+    def _delete(self, user_ids):
+        with self._lock:
+            self._tombstone_base(user_ids)
+            if any(user_id in self._delta.positions for user_id in user_ids):
+                self._delta = self._delta.copy()
+                self._delta.remove(user_ids)
+            self._publish()
+
+    def _compact(self):
+        """Folds the delta into a new base matrix; this worker stops sharing the old base pages."""
+        keep = np.ones(len(self.base_ids), dtype=bool) if self._tombstones is None else ~self._tombstones
+        self.base_ids = np.array([str(i) for i in self.base_ids[keep]] + self._delta.ids)
+        self.base_matrix = np.concatenate([self.base_matrix[keep], self._delta.rows()])
+        if self.projection is not None:
+            self.base_projected = self.projection.project(self.base_matrix)
+        self._base_positions = None
+        self._tombstones = None
+        self._delta = RowStore()
+        logger.info(f"embedding index compacted, info:{{'embeddings': {len(self.base_ids)}}}")
+
+    def search(self, query, limit=100, min_percentage=30):
+        """
+        Cosine search with the same semantics as the Mongo pipeline: dot product * 100,
+        keep matches above `min_percentage`, best `limit` first.
+        """
+        q = np.asarray(query, dtype=np.float32)
+        base_ids, base_matrix, base_projected, tombstones, delta_ids, delta_matrix = self._snapshot
+
+        candidates = max(self.candidates, limit)
+        if base_projected is not None and len(base_ids) > candidates:
+            # Stage 1: approximate ranking in the reduced space
+            approx = base_projected @ self.projection.project_query(q)
+            if tombstones is not None:
+                approx[tombstones] = -np.inf
+            positions = np.argpartition(-approx, candidates)[:candidates]
+            # Stage 2: exact scores for the candidates only
+            scores = base_matrix[positions] @ q * 100
+            if tombstones is not None:
+                scores[tombstones[positions]] = -np.inf
+        else:
+            positions = np.arange(len(base_ids))
+            scores = base_matrix @ q * 100
+            if tombstones is not None:
+                scores[tombstones] = -np.inf
+
+        base_count = len(scores)
+        if len(delta_matrix):
+            scores = np.concatenate([scores, delta_matrix @ q * 100])
+
+        return [
+            {
+                "user_id": str(base_ids[positions[i]]) if i < base_count else delta_ids[i - base_count],
+                "match_percentage": float(scores[i]),
+            }
+            for i in top_matches(scores, limit, min_percentage)
+        ]
+
+    def search_many(self, queries, limit=100, min_percentage=30):
+        """
+        Exact search for several queries (e.g. every face of a group photo) with one
+        (Q, N) matrix product, so the base matrix is streamed through once per photo.
+        """
+        base_ids, base_matrix, base_projected, tombstones, delta_ids, delta_matrix = self._snapshot
+        if base_projected is not None and len(base_ids) > max(self.candidates, limit):
+            return super().search_many(queries, limit, min_percentage)
+        q = np.asarray(queries, dtype=np.float32).reshape(-1, EMBEDDING_SIZE)
+
+        scores = q @ base_matrix.T * 100
+        if tombstones is not None:
+            scores[:, tombstones] = -np.inf
+        base_count = scores.shape[1]
+        if len(delta_matrix):
+            scores = np.concatenate([scores, q @ delta_matrix.T * 100], axis=1)
+
+        return [
+            [
+                {
+                    "user_id": str(base_ids[i]) if i < base_count else delta_ids[i - base_count],
+                    "match_percentage": float(row[i]),
+                }
+                for i in top_matches(row, limit, min_percentage)
+            ]
+            for row in scores
+        ]
@@ -1,4 +1,23 @@
-from insightface.app import FaceAnalysis
+import numpy as np
+
+from cdots.core.config import FACE_MODEL, FACE_MODEL_MODULES, FACE_MODEL_THREADS, FAKE_FACES_PER_IMAGE
+
+
+def _limit_session_threads(face_app, threads):
+    """
+    insightface does not forward SessionOptions to onnxruntime, so rebuild each model's
+    session with a fixed thread count. Sessions with their own thread pool are not
+    safe to use after fork, which matters when the model is preloaded in a gunicorn master.
+    """
+    import onnxruntime
+
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.intra_op_num_threads = threads
+    sess_options.inter_op_num_threads = 1
+    for model in face_app.models.values():
+        model.session = onnxruntime.InferenceSession(model.model_file, sess_options=sess_options,
+                                                     providers=['CPUExecutionProvider'])
+
 
 class FaceAppSingleton:
     _instance = None
@@ -6,8 +25,51 @@ class FaceAppSingleton:
     @classmethod
     def get_instance(cls):
         if cls._instance is None:
-            cls._instance = FaceAnalysis(name="buffalo_l", providers=['CPUExecutionProvider'])
+            if FACE_MODEL == "fake":
+                from cdots.core.fake_face_analysis import FakeFaceAnalysis
+                cls._instance = FakeFaceAnalysis(faces_per_image=FAKE_FACES_PER_IMAGE)
+            else:
+                from insightface.app import FaceAnalysis
+                cls._instance = FaceAnalysis(name=FACE_MODEL, allowed_modules=FACE_MODEL_MODULES,
+                                             providers=['CPUExecutionProvider'])
+                if FACE_MODEL_THREADS:
+                    _limit_session_threads(cls._instance, FACE_MODEL_THREADS)
             cls._instance.prepare(ctx_id=0)  # Load the model only once
         return cls._instance
 
 # Usage: Call `FaceAppSingleton.get_instance()` wherever needed.
+
+
+def detect_faces(face_app, img, max_num=0):
+    """
+    Runs only the detector and returns faces with bbox, kps and det_score but no embedding,
+    so callers can filter them before paying for recognition.
+    """
+    if hasattr(face_app, "detect"):
+        return face_app.detect(img, max_num=max_num)
+
+    from insightface.app.common import Face
+
+    bboxes, kpss = face_app.det_model.detect(img, max_num=max_num, metric="default")
+    return [Face(bbox=bbox[:4], kps=kpss[i] if kpss is not None else None, det_score=bbox[4])
+            for i, bbox in enumerate(bboxes)]
+
+
+def embed_faces(face_app, img, faces):
+    """
+    Fills `face.embedding` for all faces with one batched recognition call instead of one
+    model run per face, which is what `FaceAnalysis.get` does.
+    """
+    if not faces:
+        return faces
+    if hasattr(face_app, "embed"):
+        return face_app.embed(img, faces)
+
+    from insightface.utils import face_align
+
+    rec_model = face_app.models["recognition"]
+    crops = [face_align.norm_crop(img, landmark=face.kps, image_size=rec_model.input_size[0]) for face in faces]
+    embeddings = rec_model.get_feat(crops)
+    for face, embedding in zip(faces, np.asarray(embeddings).reshape(len(faces), -1)):
+        face.embedding = embedding
+    return faces
@@ -0,0 +1,103 @@
+import cv2
+import numpy as np
+from fastapi import HTTPException
+
+from cdots.core.config import (
+    FACE_QUALITY_MODE,
+    FACE_QUALITY_MIN_DET_SCORE,
+    FACE_QUALITY_MIN_FACE_PX,
+    FACE_QUALITY_MAX_YAW,
+    FACE_QUALITY_PITCH_RANGE,
+    FACE_QUALITY_MIN_SHARPNESS,
+)
+
+# Nose position between the eye line and the mouth line for a frontal face (ArcFace template: ~0.5)
+FRONTAL_PITCH = 0.5
+SHARPNESS_CROP_PX = 112
+
+
+def _pose(kps):
+    """Yaw and pitch proxies from the 5 detector landmarks (eyes, nose, mouth corners)."""
+    left_eye, right_eye, nose, left_mouth, right_mouth = np.asarray(kps, dtype=np.float32)[:5]
+    eye_mid, mouth_mid = (left_eye + right_eye) / 2, (left_mouth + right_mouth) / 2
+    eye_distance = max(float(np.linalg.norm(right_eye - left_eye)), 1e-6)
+    # Nose offset from the eye midpoint, relative to the eye distance: 0 frontal, ~0.6 at 45 degrees
+    yaw = float(np.dot(nose - eye_mid, right_eye - left_eye)) / eye_distance ** 2
+    face_height = float(mouth_mid[1] - eye_mid[1])
+    pitch = float(nose[1] - eye_mid[1]) / face_height if face_height > 0 else 0.0
+    return yaw, pitch
+
+
+def _sharpness(img, bbox):
+    """Variance of the Laplacian over the face crop, resized so the value does not depend on face size."""
+    h, w = img.shape[:2]
+    x1, y1 = max(0, int(bbox[0])), max(0, int(bbox[1]))
+    x2, y2 = min(w, int(bbox[2])), min(h, int(bbox[3]))
+    crop = img[y1:y2, x1:x2]
+    if crop.size == 0:
+        return 0.0
+    gray = cv2.cvtColor(cv2.resize(crop, (SHARPNESS_CROP_PX, SHARPNESS_CROP_PX)), cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def assess_face(img, face):
+    """
+    Cheap quality checks on a detected face, run before recognition: detector score,
+    face size, landmark pose and sharpness. Returns the metrics, a 0-1 `quality_score`
+    and the list of failed checks as `reasons`.
+    """
+    det_score = float(face.det_score)
+    face_px = float(min(face.bbox[2] - face.bbox[0], face.bbox[3] - face.bbox[1]))
+    yaw, pitch = _pose(face.kps) if face.kps is not None else (0.0, FRONTAL_PITCH)
+    sharpness = _sharpness(img, face.bbox)
+
+    reasons = []
+    if det_score < FACE_QUALITY_MIN_DET_SCORE:
+        reasons.append("low_detection_score")
+    if face_px < FACE_QUALITY_MIN_FACE_PX:
+        reasons.append("face_too_small")
+    if abs(yaw) > FACE_QUALITY_MAX_YAW or not FACE_QUALITY_PITCH_RANGE[0] <= pitch <= FACE_QUALITY_PITCH_RANGE[1]:
+        reasons.append("extreme_pose")
+    if sharpness < FACE_QUALITY_MIN_SHARPNESS:
+        reasons.append("blurry")
+
+    pitch_limit = max(FRONTAL_PITCH - FACE_QUALITY_PITCH_RANGE[0], FACE_QUALITY_PITCH_RANGE[1] - FRONTAL_PITCH)
+    pose_score = 1 - min(1.0, max(abs(yaw) / FACE_QUALITY_MAX_YAW, abs(pitch - FRONTAL_PITCH) / pitch_limit) / 2)
+    components = [
+        min(1.0, det_score),
+        min(1.0, face_px / SHARPNESS_CROP_PX),
+        pose_score,
+        min(1.0, sharpness / (4 * FACE_QUALITY_MIN_SHARPNESS)),
+    ]
+    return {
+        "quality_score": round(float(np.mean(components)), 4),
+        "reasons": reasons,
+        "metrics": {
+            "det_score": round(det_score, 4),
+            "face_px": round(face_px, 1),
+            "yaw": round(yaw, 3),
+            "pitch": round(pitch, 3),
+            "sharpness": round(sharpness, 1),
+        },
+    }
+
+
+def is_rejected(quality):
+    return FACE_QUALITY_MODE == "reject" and bool(quality["reasons"])
+
+
+def check_face_quality(img, face):
+    """
+    Assesses `face` and, with `face_quality_mode` "reject", answers 400 with the failed checks
+    before any recognition runs. In "flag" mode the result is only returned for storing.
+    """
+    if FACE_QUALITY_MODE == "off":
+        return None
+    quality = assess_face(img, face)
+    if is_rejected(quality):
+        raise HTTPException(status_code=400, detail={
+            "message": "Face quality too low, please upload a clearer, frontal photo",
+            "reasons": quality["reasons"],
+            "quality_score": quality["quality_score"],
+        })
+    return quality
@@ -0,0 +1,99 @@
+import os
+
+from cdots.core.config import FACE_SEARCH_BACKEND, FACE_SEARCH_SHARDS, FACE_SEARCH_SHARD_TIMEOUT_MS
+from cdots.core.config import FACE_SEARCH_PCA_PATH, FACE_SEARCH_PCA_CANDIDATES
+from cdots.core.embedding_index import EmbeddingIndex, load_embeddings
+from cdots.core.logging_config import get_logger
+from cdots.core.pca_projection import PcaProjection
+from cdots.db.mongo.mongo_connection import MongoDBConnection
+
+logger = get_logger()
+
+
+class SearchIndexSingleton:
+    """In-memory similar member search index for the "memory" and "sharded" search backends."""
+    _instance = None
+    _sync = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            db = MongoDBConnection().get_db()
+            if FACE_SEARCH_BACKEND == "sharded":
+                from cdots.core.sharded_search import ShardedSearch
+                cls._instance = ShardedSearch(*load_embeddings(db), num_shards=FACE_SEARCH_SHARDS,
+                                              timeout_ms=FACE_SEARCH_SHARD_TIMEOUT_MS)
+            else:
+                projection = None
+                if FACE_SEARCH_PCA_PATH:
+                    if os.path.exists(FACE_SEARCH_PCA_PATH):
+                        projection = PcaProjection.load(FACE_SEARCH_PCA_PATH)
+                    else:
+                        logger.warning(f"PCA projection {FACE_SEARCH_PCA_PATH} not found, using exact search")
+                cls._instance = EmbeddingIndex.build(db, projection=projection, candidates=FACE_SEARCH_PCA_CANDIDATES)
+        return cls._instance
+
+    @classmethod
+    def is_loaded(cls):
+        return cls._instance is not None
+
+    @classmethod
+    def start_sync(cls):
+        """Starts incremental sync from Mongo; call once per worker process, after any fork."""
+        if cls._sync is None:
+            from cdots.core.index_sync import EmbeddingIndexSync
+            cls._sync = EmbeddingIndexSync(cls.get_instance(), MongoDBConnection().get_db())
+            cls._sync.start()
+        return cls._sync
+
+    @classmethod
+    def stop(cls):
+        if cls._sync is not None:
+            cls._sync.stop()
+            cls._sync = None
+        if cls._instance is not None and hasattr(cls._instance, "stop"):
+            cls._instance.stop()
+
+
+def uses_search_index():
+    return FACE_SEARCH_BACKEND in ("memory", "sharded")
+
+
+def add_to_search_index(user_id, embedding):
+    """Makes a freshly inserted embedding searchable in this process without waiting for the index sync."""
+    if SearchIndexSingleton.is_loaded():
+        SearchIndexSingleton.get_instance().add(user_id, embedding)
+
+
+def similarity_pipeline(face_embedding, limit=100, min_percentage=30):
+    """Aggregation over `users_face_embeddings` scoring every stored embedding against `face_embedding`."""
+    return [
+        {
+            "$project": {
+                "user_id": 1,
+                "face_embedding": 1,
+                "dot_product": {
+                    "$sum": [
+                        {"$multiply": [{"$arrayElemAt": ["$face_embedding", i]}, face_embedding[i]]}
+                        for i in range(512)
+                    ]
+                }
+            }
+        },
+        {"$addFields": {"match_percentage": {"$multiply": ["$dot_product", 100]}}},
+        {"$match": {"match_percentage": {"$gt": min_percentage}}},
+        {"$sort": {"match_percentage": -1}},
+        {"$limit": limit}
+    ]
+
+
+def search_similar_many(db, face_embeddings, limit=100, min_percentage=30):
+    """
+    Similar member matches for several normalized embeddings at once. The in-memory
+    backends score them in one batch; the Mongo backend runs one pipeline per embedding.
+    """
+    if uses_search_index():
+        return SearchIndexSingleton.get_instance().search_many(face_embeddings, limit=limit,
+                                                               min_percentage=min_percentage)
+    return [list(db.users_face_embeddings.aggregate(similarity_pipeline(embedding, limit, min_percentage)))
+            for embedding in face_embeddings]
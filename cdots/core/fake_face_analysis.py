@@ -0,0 +1,67 @@
+import hashlib
+import numpy as np
+
+
+class FakeFace:
+    """Mimics the attributes of `insightface.app.common.Face` that the APIs read."""
+
+    def __init__(self, bbox, kps, det_score, embedding=None):
+        self.bbox = bbox
+        self.kps = kps
+        self.det_score = det_score
+        self.embedding = embedding
+
+
+class FakeFaceAnalysis:
+    """
+    Deterministic stand-in for insightface's FaceAnalysis, selected with `"face_model": "fake"`.
+    The same image bytes always give the same faces and embeddings, so benchmarks and
+    load tests run offline without downloading buffalo_l. `faces_per_image` faces are laid
+    out side by side to stand in for group photos.
+    """
+
+    embedding_size = 512
+
+    def __init__(self, name="fake", faces_per_image=1, **kwargs):
+        self.name = name
+        self.faces_per_image = faces_per_image
+
+    def prepare(self, ctx_id=0, **kwargs):
+        pass
+
+    @staticmethod
+    def _seed(img):
+        return int.from_bytes(hashlib.sha1(img.tobytes()).digest()[:8], "little")
+
+    def detect(self, img, max_num=0):
+        if img is None or img.size == 0:
+            return []
+        h, w = img.shape[:2]
+        count = self.faces_per_image if not max_num else min(max_num, self.faces_per_image)
+        slot = w / self.faces_per_image
+        side = min(h, slot) / 2
+        faces = []
+        for i in range(count):
+            x1, y1 = i * slot + (slot - side) / 2, (h - side) / 2
+            bbox = np.array([x1, y1, x1 + side, y1 + side], dtype=np.float32)
+            kps = np.array([
+                [x1 + 0.3 * side, y1 + 0.4 * side],
+                [x1 + 0.7 * side, y1 + 0.4 * side],
+                [x1 + 0.5 * side, y1 + 0.55 * side],
+                [x1 + 0.35 * side, y1 + 0.75 * side],
+                [x1 + 0.65 * side, y1 + 0.75 * side],
+            ], dtype=np.float32)
+            faces.append(FakeFace(bbox=bbox, kps=kps, det_score=np.float32(0.9)))
+        return faces
+
+    def embed(self, img, faces):
+        seed = self._seed(img)
+        for face in faces:
+            rng = np.random.default_rng([seed, int(face.bbox[0]), int(face.bbox[1])])
+            # Unnormalized like ArcFace output (norm around 20)
+            embedding = rng.standard_normal(self.embedding_size).astype(np.float32)
+            face.embedding = embedding * (20.0 / np.linalg.norm(embedding))
+        return faces
+
+    def get(self, img, max_num=0):
+        return self.embed(img, self.detect(img, max_num))
@@ -0,0 +1,177 @@
+import datetime
+import threading
+import time
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+from cdots.core.config import (
+    EMBEDDING_INDEX_REFRESH_S,
+    EMBEDDING_INDEX_RECONCILE_S,
+    EMBEDDING_INDEX_SYNC_BATCH,
+    EMBEDDING_INDEX_MAX_LAG_S,
+)
+from cdots.core.embedding_index import id_time
+from cdots.core.logging_config import get_logger
+
+logger = get_logger()
+
+# Re-read inserts this far behind the newest seen _id: ObjectIds from different processes
+# are only ordered by their leading timestamp, not within the same second
+POLL_OVERLAP_S = 2
+RETRY_DELAY_S = 5
+
+
+class EmbeddingIndexSync:
+    """
+    Keeps an in-memory search index consistent with `users_face_embeddings` without
+    reloading it. Runs in a background thread per worker:
+
+    - change stream mode (replica set): tails inserts, updates, replaces and deletes,
+      resuming from the last resume token after errors;
+    - polling mode (standalone mongod): reads documents with `_id` past the watermark
+      every `embedding_index_refresh_s`, and diffs the full id list every
+      `embedding_index_reconcile_s` to pick up deletes.
+
+    Changes are applied in batches of at most `embedding_index_sync_batch`. `lag_s` is the
+    time since the sync was last known to be caught up with the collection.
+    """
+
+    def __init__(self, index, db):
+        self.index = index
+        self.collection = db.users_face_embeddings
+        self.client = db.client
+        self.mode = None
+        self.applied_upserts = 0
+        self.applied_deletes = 0
+        self.last_error = None
+        self._watermark = index.watermark
+        self._caught_up_at = time.time()
+        self._last_reconcile = time.monotonic()
+        self._resume_token = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cdots-index-sync", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=RETRY_DELAY_S)
+
+    @property
+    def lag_s(self):
+        return max(0.0, time.time() - self._caught_up_at)
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "indexed": len(self.index),
+            "applied_upserts": self.applied_upserts,
+            "applied_deletes": self.applied_deletes,
+            "lag_s": round(self.lag_s, 3),
+            "last_error": self.last_error,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._supports_change_streams():
+                    self.mode = "change_stream"
+                    self._tail_change_stream()
+                else:
+                    self.mode = "polling"
+                    self._poll_loop()
+            except PyMongoError as e:
+                self.last_error = repr(e)
+                logger.warning(f"embedding index sync failed, retrying, info:{e}")
+                self._stop.wait(RETRY_DELAY_S)
+
+    def _supports_change_streams(self):
+        try:
+            return "setName" in self.client.admin.command("hello")
+        except Exception:
+            return False
+
+    def _apply(self, upserts, deletes):
+        if upserts:
+            self.index.upsert_many([u for u, _ in upserts], [e for _, e in upserts])
+            self.applied_upserts += len(upserts)
+        if deletes:
+            self.index.delete(deletes)
+            self.applied_deletes += len(deletes)
+
+    def _mark_caught_up(self):
+        self._caught_up_at = time.time()
+
+    def _check_lag(self):
+        if self.lag_s > EMBEDDING_INDEX_MAX_LAG_S:
+            logger.warning(f"embedding index sync is lagging, info:{self.stats()}")
+
+    # Polling mode
+
+    def _poll_loop(self):
+        while not self._stop.is_set():
+            self._poll_inserts()
+            if time.monotonic() - self._last_reconcile >= EMBEDDING_INDEX_RECONCILE_S:
+                self._reconcile_deletes()
+            self._mark_caught_up()
+            self._stop.wait(EMBEDDING_INDEX_REFRESH_S)
+            self._check_lag()
+
+    def _poll_inserts(self):
+        query = {}
+        if self._watermark:
+            since = self._watermark - datetime.timedelta(seconds=POLL_OVERLAP_S)
+            query = {"_id": {"$gte": str(ObjectId.from_datetime(since))}}
+        batch = []
+        cursor = self.collection.find(query, {"user_id": 1, "face_embedding": 1}).sort("_id", 1)
+        for doc in cursor.batch_size(EMBEDDING_INDEX_SYNC_BATCH):
+            doc_time = id_time(doc["_id"])
+            if doc_time and (self._watermark is None or doc_time > self._watermark):
+                self._watermark = doc_time
+            # The overlap window re-reads recent inserts, skip the ones already indexed
+            if str(doc["user_id"]) not in self.index:
+                batch.append((doc["user_id"], doc.get("face_embedding")))
+            if len(batch) >= EMBEDDING_INDEX_SYNC_BATCH:
+                self._apply(batch, [])
+                batch = []
+        self._apply(batch, [])
+
+    def _reconcile_deletes(self):
+        self._last_reconcile = time.monotonic()
+        source_ids = {str(doc["user_id"]) for doc in self.collection.find({}, {"user_id": 1})}
+        removed = list(self.index.ids() - source_ids)
+        for start in range(0, len(removed), EMBEDDING_INDEX_SYNC_BATCH):
+            self._apply([], removed[start:start + EMBEDDING_INDEX_SYNC_BATCH])
+
+    # Change stream mode
+
+    def _tail_change_stream(self):
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        if self._resume_token:
+            options = {"resume_after": self._resume_token}
+        else:
+            # Catch up on what happened since the index was built, then stream from that point on
+            options = {"start_at_operation_time": self.client.admin.command("hello")["operationTime"]}
+            self._poll_inserts()
+            self._reconcile_deletes()
+
+        with self.collection.watch(pipeline, full_document="updateLookup", max_await_time_ms=500, **options) as stream:
+            while not self._stop.is_set() and stream.alive:
+                upserts, deletes = [], []
+                while len(upserts) + len(deletes) < EMBEDDING_INDEX_SYNC_BATCH:
+                    change = stream.try_next()
+                    if change is None:
+                        break
+                    if change["operationType"] == "delete":
+                        deletes.append(change["documentKey"]["_id"])
+                    elif change.get("fullDocument"):
+                        doc = change["fullDocument"]
+                        upserts.append((doc.get("user_id", doc["_id"]), doc.get("face_embedding")))
+                    self._caught_up_at = min(time.time(), change["clusterTime"].as_datetime().timestamp())
+                self._apply(upserts, deletes)
+                self._resume_token = stream.resume_token
+                if not upserts and not deletes:
+                    self._mark_caught_up()
+                self._check_lag()
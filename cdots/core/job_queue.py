@@ -0,0 +1,220 @@
+import asyncio
+import concurrent.futures
+import datetime
+import threading
+import time
+import uuid
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from cdots.core.admission import Overloaded
+from cdots.core.config import JOB_WORKERS, JOB_POLL_S, JOB_LEASE_S, JOB_MAX_ATTEMPTS, JOB_RETENTION_S
+from cdots.core.logging_config import get_logger
+from cdots.db.mongo.mongo_connection import MongoDBConnection
+
+logger = get_logger()
+
+
+class JobQueue:
+    """
+    Mongo-backed background jobs (`background_jobs` collection), no external broker.
+
+    Each app process runs `job_workers` threads that claim queued jobs with an atomic
+    find-and-modify, so several gunicorn workers can share one queue. A claimed job holds
+    a lease of `job_lease_s`; if its process dies the job is picked up again once the lease
+    expires, up to `job_max_attempts` times. Handlers must therefore be safe to re-run.
+    Jobs submitted with the same idempotency key map to a single job. Once a job is finished
+    for good (succeeded, failed or abandoned) its payload is dropped, the handler's `cleanup`
+    runs, and the job document expires `job_retention_s` later.
+
+    A handler registered with a `limiter` (an admission ConcurrencyLimiter) only runs once it
+    holds a slot, acquired on the event loop that called `start()`, so background work and
+    requests share the same inference cap. A job that cannot get a slot goes back to the queue.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection.create_index("idempotency_key", unique=True, sparse=True)
+        self.collection.create_index([("status", 1), ("lease_until", 1)])
+        # Only finished jobs have the field, queued and running ones never expire
+        self.collection.create_index("t__finished_at", expireAfterSeconds=int(JOB_RETENTION_S))
+        self.handlers = {}
+        self.limiters = {}
+        self.cleanups = {}
+        self._loop = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def collection(self):
+        # Looked up on each use: the Mongo client is reopened after a fork (see mongo_connection.py)
+        return self.db.background_jobs
+
+    def register_handler(self, kind, handler, limiter=None, cleanup=None):
+        """
+        `handler(payload, set_step)` returns the job result or raises HTTPException to fail it.
+        `cleanup(payload)` runs once the job is finished for good, e.g. to remove its upload.
+        """
+        self.handlers[kind] = handler
+        if limiter is not None:
+            self.limiters[kind] = limiter
+        if cleanup is not None:
+            self.cleanups[kind] = cleanup
+
+    def submit(self, kind, payload, idempotency_key=None):
+        """Queues a job and returns its document; an existing key returns the job it created."""
+        now = datetime.datetime.now()
+        job = {
+            "_id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": "queued",
+            "step": None,
+            "attempts": 0,
+            "payload": payload,
+            "result": None,
+            "error": None,
+            "lease_until": None,
+            "t__created_at": now,
+            "t__updated_at": now
+        }
+        if idempotency_key:
+            job["idempotency_key"] = f"{kind}:{idempotency_key}"
+        try:
+            self.collection.insert_one(job)
+        except DuplicateKeyError:
+            return self.collection.find_one({"idempotency_key": job["idempotency_key"]}), False
+        self._wake.set()
+        return job, True
+
+    def get(self, job_id):
+        return self.collection.find_one({"_id": job_id}, {"payload": 0})
+
+    def start(self, workers=JOB_WORKERS):
+        """Starts the worker threads; call once per worker process, after any fork."""
+        if self._threads:
+            return
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        self._stop.clear()
+        for n in range(workers):
+            thread = threading.Thread(target=self._run, name=f"cdots-job-worker-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout=JOB_POLL_S + 1)
+        self._threads = []
+
+    def _claim(self):
+        now = datetime.datetime.now()
+        return self.collection.find_one_and_update(
+            {"kind": {"$in": list(self.handlers)},
+             "$or": [{"status": "queued"}, {"status": "processing", "lease_until": {"$lt": now}}]},
+            {"$set": {"status": "processing", "lease_until": now + datetime.timedelta(seconds=JOB_LEASE_S),
+                      "t__updated_at": now},
+             "$inc": {"attempts": 1}},
+            sort=[("t__created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _update(self, job_id, fields):
+        fields["t__updated_at"] = datetime.datetime.now()
+        self.collection.update_one({"_id": job_id}, {"$set": fields})
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except PyMongoError as e:
+                logger.warning(f"job queue claim failed, info:{e}")
+                job = None
+            if job is None:
+                self._wake.wait(JOB_POLL_S)
+                self._wake.clear()
+                continue
+            self._process(job)
+
+    def _acquire(self, limiter):
+        """Waits on the app's event loop for a slot of `limiter`; False when it stays saturated."""
+        deadline = self._loop.time() + JOB_LEASE_S / 2
+        fut = asyncio.run_coroutine_threadsafe(limiter.acquire(deadline), self._loop)
+        try:
+            # The limiter gives up at `deadline`; waiting longer only happens once the loop has stopped
+            fut.result(timeout=JOB_LEASE_S)
+        except Overloaded:
+            return False
+        except concurrent.futures.TimeoutError:
+            fut.cancel()
+            return False
+        return True
+
+    def _release(self, limiter, service_s):
+        try:
+            self._loop.call_soon_threadsafe(limiter.release, service_s)
+        except RuntimeError:
+            pass  # loop already closed at shutdown
+
+    def _finish(self, job, fields):
+        """Records the final state, drops the payload (it may hold credentials) and runs the cleanup."""
+        now = datetime.datetime.now()
+        self.collection.update_one({"_id": job["_id"]}, {
+            "$set": dict(fields, lease_until=None, t__updated_at=now, t__finished_at=now),
+            "$unset": {"payload": ""}
+        })
+        cleanup = self.cleanups.get(job["kind"])
+        if cleanup is not None:
+            try:
+                cleanup(job["payload"])
+            except Exception as e:
+                logger.error(f"background job cleanup failed, info:{{'job_id': '{job['_id']}', 'error': {e!r}}}")
+
+    def _requeue(self, job_id):
+        # Not an attempt: the handler never ran
+        self.collection.update_one({"_id": job_id}, {"$set": {"status": "queued", "lease_until": None,
+                                                              "t__updated_at": datetime.datetime.now()},
+                                                     "$inc": {"attempts": -1}})
+
+    def _process(self, job):
+        if job["attempts"] > JOB_MAX_ATTEMPTS:
+            self._finish(job, {"status": "failed",
+                               "error": {"status_code": 500, "detail": "Job abandoned after repeated attempts"}})
+            return
+
+        limiter = self.limiters.get(job["kind"]) if self._loop is not None else None
+        if limiter is not None and not self._acquire(limiter):
+            self._requeue(job["_id"])
+            self._stop.wait(JOB_POLL_S)
+            return
+        start = time.perf_counter()
+        try:
+            self._run_handler(job)
+        finally:
+            if limiter is not None:
+                self._release(limiter, time.perf_counter() - start)
+
+    def _run_handler(self, job):
+        def set_step(step):
+            self._update(job["_id"], {"step": step})
+
+        try:
+            result = self.handlers[job["kind"]](job["payload"], set_step)
+        except HTTPException as e:
+            self._finish(job, {"status": "failed", "error": {"status_code": e.status_code, "detail": e.detail}})
+        except Exception as e:
+            logger.error(f"background job failed, info:{{'job_id': '{job['_id']}', 'kind': '{job['kind']}', "
+                         f"'attempts': {job['attempts']}, 'error': {e!r}}}")
+            # Left to the lease: it is retried once the lease expires
+            self._update(job["_id"], {"error": {"status_code": 500, "detail": repr(e)}})
+        else:
+            self._finish(job, {"status": "succeeded", "step": "done", "result": result, "error": None})
+
+
+job_queue = JobQueue(MongoDBConnection().get_db())
@@ -0,0 +1,163 @@
+import datetime
+
+import numpy as np
+from pymongo import UpdateOne
+
+from cdots.core.embedding_index import EMBEDDING_SIZE, id_time, load_embeddings, top_matches
+from cdots.core.logging_config import get_logger
+
+logger = get_logger()
+
+MIN_MATCH_PERCENTAGE = 30
+# Users per add_users() call, which bounds its (batch, N) score matrix
+ADD_BATCH = 256
+
+
+class NeighbourLists:
+    """
+    Precomputed top-k most similar faces per user, stored in `user_similar_members`
+    (`_id` = user_id) so suggestions are a single indexed read. `rebuild_all()` computes
+    every list with blocked matrix multiplies; `add_users()` handles new embeddings by
+    computing their own lists and pushing them into the lists they now belong to, and
+    `reconcile()` repairs the lists after embeddings are deleted or replaced.
+    Scores use the same dot product * 100 > 30 rule as fetch-similar-members-by-pic.
+    """
+
+    def __init__(self, db, k):
+        self.db = db
+        self.k = k
+        self.ids = []
+        self.positions = {}
+        self.matrix = np.empty((0, EMBEDDING_SIZE), dtype=np.float32)
+        self.watermark = None
+
+    def load(self, processed_until=None):
+        """
+        Loads all embeddings. Those inserted after `processed_until` (the last run's watermark)
+        are held back and returned as (ids, embeddings) so the caller can pass them to `add_users()`.
+        """
+        ids, matrix = load_embeddings(self.db)
+        pending = np.zeros(len(ids), dtype=bool)
+        if processed_until is not None:
+            pending = np.array([(id_time(i) or processed_until) > processed_until for i in ids], dtype=bool)
+        self.ids = [i for i, p in zip(ids, pending) if not p]
+        self.matrix = matrix[~pending]
+        self.positions = {user_id: i for i, user_id in enumerate(self.ids)}
+        self.watermark = max(filter(None, map(id_time, ids)), default=processed_until)
+        return [i for i, p in zip(ids, pending) if p], matrix[pending].tolist()
+
+    def _top_k(self, scores, self_position):
+        if self_position is not None:
+            scores[self_position] = -np.inf
+        return [(self.ids[i], float(scores[i])) for i in top_matches(scores, self.k, MIN_MATCH_PERCENTAGE)]
+
+    def _recompute(self, positions, max_block_bytes=256 << 20):
+        # Rows per block so that one block's (rows, N) score matrix stays under max_block_bytes
+        block_size = max(1, min(4096, max_block_bytes // (4 * max(1, len(self.ids)))))
+        for block_start in range(0, len(positions), block_size):
+            rows = positions[block_start:block_start + block_size]
+            scores = self.matrix[rows] @ self.matrix.T * 100
+            self._write({self.ids[p]: self._top_k(scores[r], p) for r, p in enumerate(rows)})
+
+    def rebuild_all(self, max_block_bytes=256 << 20):
+        start = datetime.datetime.now()
+        self._recompute(np.arange(len(self.ids)), max_block_bytes)
+        logger.info(f"neighbour lists rebuilt, info:{{'users': {len(self.ids)}, "
+                    f"'seconds': {(datetime.datetime.now() - start).total_seconds()}}}")
+
+    def add_users(self, user_ids, embeddings):
+        """Indexes new users and updates every list they enter. Returns the number of lists written."""
+        new_ids, new_rows = [], []
+        for user_id, embedding in zip(user_ids, embeddings):
+            user_id = str(user_id)
+            if user_id not in self.positions and embedding and len(embedding) == EMBEDDING_SIZE:
+                new_ids.append(user_id)
+                new_rows.append(embedding)
+        if not new_ids:
+            return 0
+
+        old_count = len(self.ids)
+        for user_id in new_ids:
+            self.positions[user_id] = len(self.ids)
+            self.ids.append(user_id)
+        self.matrix = np.concatenate([self.matrix, np.asarray(new_rows, dtype=np.float32)])
+
+        # Lists of the new users against everyone
+        new_scores = self.matrix[old_count:] @ self.matrix.T * 100
+        lists = {user_id: self._top_k(new_scores[r].copy(), old_count + r) for r, user_id in enumerate(new_ids)}
+
+        # Existing users that any new user is similar enough to
+        old_scores = new_scores[:, :old_count]
+        affected = np.flatnonzero((old_scores > MIN_MATCH_PERCENTAGE).any(axis=0))
+        if len(affected):
+            current = {doc["_id"]: doc.get("neighbours", [])
+                       for doc in self.db.user_similar_members.find(
+                           {"_id": {"$in": [self.ids[j] for j in affected]}}, {"neighbours.user_id": 1,
+                                                                              "neighbours.match_percentage": 1})}
+            new_id_set = set(new_ids)
+            for j in affected:
+                user_id = self.ids[j]
+                merged = {n["user_id"]: n["match_percentage"] for n in current.get(user_id, [])}
+                for r in np.flatnonzero(old_scores[:, j] > MIN_MATCH_PERCENTAGE):
+                    merged[new_ids[r]] = float(old_scores[r, j])
+                top = sorted(merged.items(), key=lambda item: -item[1])[:self.k]
+                if any(neighbour_id in new_id_set for neighbour_id, _ in top):
+                    lists[user_id] = top
+
+        self._write(lists)
+        return len(lists)
+
+    def reconcile(self):
+        """
+        Compares the index with `users_face_embeddings`: users whose embedding was deleted lose
+        their list and drop out of everyone else's, users whose embedding was replaced are
+        recomputed, and users not indexed yet are added. Returns the number of users changed.
+        """
+        ids, matrix = load_embeddings(self.db)
+        current = dict(zip(ids, matrix))
+        removed = [user_id for user_id in self.ids if user_id not in current]
+        replaced = [user_id for user_id in self.ids
+                    if user_id in current and not np.array_equal(current[user_id], self.matrix[self.positions[user_id]])]
+        added = [user_id for user_id in ids if user_id not in self.positions]
+        stale = removed + replaced
+        if stale:
+            # Lists that point at a stale embedding are recomputed without it
+            affected = [doc["_id"] for doc in self.db.user_similar_members.find(
+                {"neighbours.user_id": {"$in": stale}, "_id": {"$nin": stale}}, {"_id": 1})]
+            if removed:
+                self.db.user_similar_members.delete_many({"_id": {"$in": removed}})
+            stale_set = set(stale)
+            keep = np.array([user_id not in stale_set for user_id in self.ids], dtype=bool)
+            self.ids = [user_id for user_id, k in zip(self.ids, keep) if k]
+            self.matrix = self.matrix[keep]
+            self.positions = {user_id: i for i, user_id in enumerate(self.ids)}
+            self._recompute(np.array([self.positions[user_id] for user_id in affected if user_id in self.positions],
+                                     dtype=np.int64))
+        changed = replaced + added
+        for start in range(0, len(changed), ADD_BATCH):
+            batch = changed[start:start + ADD_BATCH]
+            self.add_users(batch, [current[user_id].tolist() for user_id in batch])
+        if stale or added:
+            logger.info(f"neighbour lists reconciled, info:{{'removed': {len(removed)}, "
+                        f"'replaced': {len(replaced)}, 'added': {len(added)}}}")
+        return len(stale) + len(added)
+
+    def _write(self, lists):
+        neighbour_ids = {n for neighbours in lists.values() for n, _ in neighbours}
+        profiles = {u["_id"]: u for u in self.db.users.find({"_id": {"$in": list(neighbour_ids)}},
+                                                            {"full_name": 1, "profile_pic": 1})}
+        now = datetime.datetime.now()
+        operations = [
+            UpdateOne({"_id": user_id}, {"$set": {
+                "neighbours": [{
+                    "user_id": neighbour_id,
+                    "full_name": profiles.get(neighbour_id, {}).get("full_name"),
+                    "profile_pic": profiles.get(neighbour_id, {}).get("profile_pic"),
+                    "match_percentage": round(score, 2),
+                } for neighbour_id, score in neighbours],
+                "t__updated_at": now,
+            }}, upsert=True)
+            for user_id, neighbours in lists.items()
+        ]
+        if operations:
+            self.db.user_similar_members.bulk_write(operations, ordered=False)
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+class PcaProjection:
+    """
+    Linear projection of 512-d face embeddings onto their top principal components,
+    used for the candidate pass of two-stage search. Fit and saved with
+    `python -m scripts.fit_pca_projection`.
+    """
+
+    def __init__(self, mean, components, explained_variance_ratio=None):
+        self.mean = mean.astype(np.float32)
+        self.components = components.astype(np.float32)  # (dims, 512)
+        self.explained_variance_ratio = explained_variance_ratio
+
+    @property
+    def dims(self):
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, matrix, dims):
+        centered = matrix - matrix.mean(axis=0)
+        # Economy SVD of the centred sample; rows of vt are the principal axes
+        _, singular_values, vt = np.linalg.svd(centered, full_matrices=False)
+        variance = singular_values ** 2
+        return cls(matrix.mean(axis=0), vt[:dims], variance[:dims] / variance.sum())
+
+    def project(self, vectors):
+        """Projects (N, 512) stored embeddings; the mean is removed so rankings match the full dot product."""
+        return (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components.T
+
+    def project_query(self, query):
+        # q . x = q . mean + (W q) . W (x - mean) + residual; q . mean is the same for every x
+        return self.components @ np.asarray(query, dtype=np.float32)
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, components=self.components,
+                 explained_variance_ratio=self.explained_variance_ratio)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["mean"], data["components"], data["explained_variance_ratio"])
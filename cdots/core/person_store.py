@@ -0,0 +1,141 @@
+import contextlib
+import fcntl
+import json
+import os
+import threading
+
+import numpy as np
+
+from cdots.core.config import PERSON_STORE_COMPACT_BYTES
+from cdots.core.logging_config import get_logger
+
+logger = get_logger()
+
+
+class PersonStore:
+    """
+    In-memory index of the legacy `/upload/` records (name, relation_to, relation_type,
+    embedding, image_path) with a name -> record dict, an inverted `relation_to` index and
+    a contiguous embedding matrix for vectorized distance matching.
+
+    Records are read from the JSON array in `path` plus an append-only journal
+    (`<path>.journal.jsonl`); new records are appended to the journal only, so an upload
+    costs one line of I/O instead of rewriting the whole file. Once the journal passes
+    `compact_bytes` it is folded back into the JSON array, on load and after an add.
+    File changes hold an exclusive lock on `<path>.lock`, so workers sharing the files
+    never compact over each other's appends.
+    """
+
+    def __init__(self, path, compact_bytes=PERSON_STORE_COMPACT_BYTES):
+        self.path = path
+        self.journal_path = path + ".journal.jsonl"
+        self.lock_path = path + ".lock"
+        self.compact_bytes = compact_bytes
+        self.records = []
+        self.by_name = {}
+        self.by_relation_to = {}
+        self.matrix = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, compact_bytes=PERSON_STORE_COMPACT_BYTES):
+        store = cls(path, compact_bytes)
+        records = []
+        # Nothing stored yet: leave the folder alone until the first add()
+        if store._has_files():
+            with store._file_lock():
+                if store._journal_size() > store.compact_bytes:
+                    store._compact_files()
+                records = store._read_files()
+        for record in records:
+            store._index(record)
+        logger.info(f"person store loaded, info:{{'records': {len(store.records)}}}")
+        return store
+
+    def _has_files(self):
+        return os.path.exists(self.path) or os.path.exists(self.journal_path)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _journal_size(self):
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
+
+    def _read_files(self):
+        records = []
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                records = json.load(f)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+        return records
+
+    def _compact_files(self):
+        """Rewrites the JSON array from the files (not from memory, other workers may have appended)."""
+        records = self._read_files()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(records, f, indent=4)
+        os.replace(tmp_path, self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        logger.info(f"person store compacted, info:{{'records': {len(records)}}}")
+
+    def __len__(self):
+        return len(self.records)
+
+    def _index(self, record):
+        embedding = np.asarray(record["embedding"], dtype=np.float32)
+        count = len(self.records)
+        if self.matrix is None:
+            self.matrix = np.empty((max(1024, count + 1), len(embedding)), dtype=np.float32)
+        elif count == len(self.matrix):
+            self.matrix = np.concatenate([self.matrix, np.empty_like(self.matrix)])
+        self.matrix[count] = embedding
+        self.records.append(record)
+        # First record wins, like the linear scan it replaces
+        self.by_name.setdefault(record["name"], record)
+        self.by_relation_to.setdefault(record["relation_to"], []).append(record)
+
+    def add(self, record):
+        with self._lock:
+            self._index(record)
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        with self._file_lock():
+            with open(self.journal_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            if self._journal_size() > self.compact_bytes:
+                self._compact_files()
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def relations_of(self, name):
+        return list(self.by_relation_to.get(name, []))
+
+    def find_within(self, embedding, max_distance):
+        """Records whose stored embedding is within `max_distance` (euclidean), in insertion order."""
+        with self._lock:
+            count = len(self.records)
+            if not count:
+                return []
+            matrix = self.matrix[:count]
+            distances = np.linalg.norm(matrix - np.asarray(embedding, dtype=np.float32), axis=1)
+            return [self.records[i] for i in np.flatnonzero(distances < max_distance)]
+
+    def compact(self):
+        """Folds the journal into the JSON array now, whatever its size."""
+        if not self._has_files():
+            return
+        with self._file_lock():
+            self._compact_files()
@@ -0,0 +1,314 @@
+import contextlib
+import contextvars
+import cProfile
+import collections
+import functools
+import hmac
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+
+from fastapi import Request
+
+from cdots.core.config import (
+    LOGS_FOLDER,
+    PROFILER_ENABLED,
+    PROFILER_MODE,
+    PROFILER_SAMPLE_RATE,
+    PROFILER_ADMIN_TOKEN,
+    PROFILER_INTERVAL_MS,
+    PROFILER_MAX_PER_MINUTE,
+)
+from cdots.core.logging_config import get_logger
+
+logger = get_logger()
+
+PROFILE_HEADER = "x-cdots-profile"
+PROFILES_FOLDER = os.path.join(LOGS_FOLDER, "profiles")
+
+
+# Innermost frames of a thread that is parked rather than working: idle event loop,
+# threadpool workers waiting for a task, lock and condition waits
+PARKED_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+# A profile whose response body was never consumed releases its slot after this long
+MAX_PROFILE_S = 300
+
+_active_profile = contextvars.ContextVar("cdots_active_profile", default=None)
+
+
+class StackSampler:
+    """
+    Statistical profiler: a background thread snapshots the stacks of the threads serving
+    the profiled request at a fixed interval and counts them in collapsed-stack form
+    ("frame;frame;frame count"), which flamegraph.pl / speedscope read directly.
+    Parked stacks (idle loop, waiting workers) are counted in `idle_samples` only.
+    """
+
+    def __init__(self, interval_ms=5):
+        self.interval = interval_ms / 1000.0
+        self.counts = collections.Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self.thread_ids = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cdots-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        names = {}
+        while not self._stop.wait(self.interval):
+            thread_ids = set(self.thread_ids)
+            frames = sys._current_frames()
+            for t in threading.enumerate():
+                names[t.ident] = t.name
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                if (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in PARKED_FRAMES:
+                    self.idle_samples += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RequestProfile:
+    """
+    Profile of one request, scoped to the threads working for it: the event loop thread
+    (sample mode only; other requests' coroutines can interleave there) and the threadpool
+    threads running its blocking calls and streamed body, which attach through `traced()`.
+    cProfile mode profiles each attached call in its own thread and merges the results, so
+    it covers the offloaded work (inference, hashing, search, hydration) only.
+    """
+
+    def __init__(self, mode, interval_ms):
+        self.mode = mode
+        self.sampler = StackSampler(interval_ms) if mode != "cprofile" else None
+        self.cprofiles = []
+        self.threads = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.sampler is not None:
+            self.sampler.thread_ids.add(threading.get_ident())
+            self.sampler.start()
+
+    def stop(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    @contextlib.contextmanager
+    def attach(self):
+        """Profiles the current thread while the block runs."""
+        thread_id = threading.get_ident()
+        with self._lock:
+            self.threads.add(thread_id)
+        if self.sampler is not None:
+            self.sampler.thread_ids.add(thread_id)
+            try:
+                yield
+            finally:
+                self.sampler.thread_ids.discard(thread_id)
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one active cProfile per interpreter
+            profiler = None
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                with self._lock:
+                    self.cprofiles.append(profiler)
+
+    def write(self, base_path):
+        if self.sampler is not None:
+            path = base_path + ".collapsed"
+            self.sampler.write(path)
+        else:
+            path = base_path + ".pstats"
+            stats = pstats.Stats()
+            for profiler in self.cprofiles:
+                stats.add(profiler)
+            stats.dump_stats(path)
+        return path
+
+    def meta(self):
+        meta = {"threads": len(self.threads) + (1 if self.sampler is not None else 0)}
+        if self.sampler is not None:
+            meta.update({"samples": self.sampler.samples, "idle_samples": self.sampler.idle_samples})
+        else:
+            meta["profiled_calls"] = len(self.cprofiles)
+        return meta
+
+
+def traced(fn):
+    """Wraps `fn` so that, when it runs for a profiled request, its thread is part of the profile."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = _active_profile.get()
+        if profile is None:
+            return fn(*args, **kwargs)
+        with profile.attach():
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def traced_iterator(iterable):
+    """Like `traced()` for a sync iterator consumed from the threadpool, e.g. a streamed response body."""
+    iterator = iter(iterable)
+    next_item = traced(next)
+    while True:
+        try:
+            item = next_item(iterator)
+        except StopIteration:
+            return
+        yield item
+
+
+class ProfileLimiter:
+    """Allows at most one profile in flight and `max_per_minute` profiles per sliding minute."""
+
+    def __init__(self, max_per_minute):
+        self.max_per_minute = max_per_minute
+        self._started = collections.deque()
+        self._active_since = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._started and now - self._started[0] > 60:
+                self._started.popleft()
+            active = self._active_since is not None and now - self._active_since < MAX_PROFILE_S
+            if active or len(self._started) >= self.max_per_minute:
+                return False
+            self._started.append(now)
+            self._active_since = now
+            return True
+
+    def release(self):
+        with self._lock:
+            self._active_since = None
+
+
+limiter = ProfileLimiter(PROFILER_MAX_PER_MINUTE)
+
+
+def should_profile(request: Request):
+    """
+    A request is profiled when it carries the admin header with the configured token,
+    or when it is picked by the sampling rate. Returns the trigger name or None.
+    """
+    token = request.headers.get(PROFILE_HEADER)
+    if token and PROFILER_ADMIN_TOKEN and hmac.compare_digest(token, PROFILER_ADMIN_TOKEN):
+        return "header"
+    if PROFILER_SAMPLE_RATE > 0 and random.random() < PROFILER_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def _route_tag(request: Request):
+    route = request.scope.get("route")
+    path = getattr(route, "path", request.url.path)
+    return path.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+
+
+async def profile_request_middleware(request: Request, call_next):
+    """
+    HTTP middleware that profiles a single request, including its streamed response body,
+    and writes the result to `<logs_folder>/profiles`, tagged with route and timings.
+    """
+    trigger = should_profile(request) if PROFILER_ENABLED else None
+    if not trigger or not limiter.acquire():
+        return await call_next(request)
+
+    profile = RequestProfile(PROFILER_MODE, PROFILER_INTERVAL_MS)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    def finish(status_code):
+        try:
+            wall_ms = (time.perf_counter() - wall_start) * 1000
+            cpu_ms = (time.process_time() - cpu_start) * 1000
+            profile.stop()
+
+            os.makedirs(PROFILES_FOLDER, exist_ok=True)
+            base_name = "{}__{}__{}__{}ms__{}".format(
+                time.strftime("%Y%m%dT%H%M%S"), request.method, _route_tag(request), int(wall_ms), uuid.uuid4().hex[:8])
+            base_path = os.path.join(PROFILES_FOLDER, base_name)
+            profile_path = profile.write(base_path)
+
+            meta = {
+                "method": request.method,
+                "path": request.url.path,
+                "route": getattr(request.scope.get("route"), "path", None),
+                "status_code": status_code,
+                "trigger": trigger,
+                "mode": PROFILER_MODE,
+                "wall_ms": round(wall_ms, 2),
+                "cpu_ms": round(cpu_ms, 2),
+                "profile": profile_path,
+                **profile.meta(),
+            }
+            with open(base_path + ".json", "w") as f:
+                json.dump(meta, f, indent=4)
+            logger.info(f"request profile written, info:{meta}")
+        finally:
+            limiter.release()
+
+    token = _active_profile.set(profile)
+    try:
+        profile.start()
+        response = await call_next(request)
+    except BaseException:
+        finish(None)
+        raise
+    finally:
+        _active_profile.reset(token)
+
+    body_iterator = response.body_iterator
+
+    async def profiled_body():
+        # The body (e.g. a streamed NDJSON response) is produced while it is consumed here
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            finish(response.status_code)
+
+    response.body_iterator = profiled_body()
+    return response
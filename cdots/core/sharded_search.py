@@ -0,0 +1,217 @@
+import hashlib
+import heapq
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from cdots.core.embedding_index import BaseSearchIndex, RowStore
+from cdots.core.logging_config import get_logger
+
+logger = get_logger()
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def _mix64(x):
+    """splitmix64 finalizer over a uint64 array (wrapping arithmetic)."""
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return (x ^ (x >> np.uint64(31))) & _MASK64
+
+
+def shard_owners(ids, num_shards):
+    """
+    Rendezvous (highest random weight) hashing of user ids onto `num_shards` shards.
+    Changing the shard count only moves the ids whose winning shard changed, about
+    1/N of them, instead of reshuffling everything like `hash % N` would.
+    """
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(i.encode(), digest_size=8).digest(), "little") for i in ids),
+        dtype=np.uint64, count=len(ids))
+    weights = np.stack([_mix64(hashes ^ _mix64(np.uint64(shard + 1))) for shard in range(num_shards)])
+    return weights.argmax(axis=0)
+
+
+def _shard_main(conn, shard_no):
+    """Shard process loop: answers (op, request_id, payload) messages on `conn`."""
+    data = RowStore()
+    while True:
+        try:
+            op, request_id, payload = conn.recv()
+        except EOFError:
+            return
+        try:
+            if op == "search":
+                result = data.search(*payload)
+            elif op == "upsert":
+                data.upsert(*payload)
+                result = len(data.ids)
+            elif op == "delete":
+                result = data.remove(payload)
+            elif op == "extract":
+                # Hand back the rows this shard no longer owns with `payload` shards in total
+                num_shards = payload
+                if shard_no >= num_shards:
+                    mask = np.ones(len(data.ids), dtype=bool)
+                else:
+                    mask = shard_owners(data.ids, num_shards) != shard_no
+                result = data.take(mask)
+            elif op == "stop":
+                conn.send(("ok", request_id, None))
+                return
+            else:
+                raise ValueError(f"unknown op {op}")
+            conn.send(("ok", request_id, result))
+        except Exception as e:
+            conn.send(("error", request_id, repr(e)))
+
+
+class _ShardClient:
+    """Parent-side handle of one shard process; a reader thread resolves reply futures."""
+
+    def __init__(self, ctx, shard_no):
+        self.shard_no = shard_no
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_shard_main, args=(child_conn, shard_no),
+                                   name=f"cdots-search-shard-{shard_no}", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self._pending = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, name=f"cdots-shard-reader-{shard_no}", daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        while True:
+            try:
+                status, request_id, payload = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            fut = self._pending.pop(request_id, None)
+            if fut is None:
+                continue  # caller already gave up on it
+            if status == "error":
+                fut.set_exception(RuntimeError(f"shard {self.shard_no}: {payload}"))
+            else:
+                fut.set_result(payload)
+        for fut in list(self._pending.values()):
+            fut.set_exception(RuntimeError(f"shard {self.shard_no} exited"))
+        self._pending.clear()
+
+    def submit(self, op, payload=None):
+        fut = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = fut
+            self.conn.send((op, request_id, payload))
+        return fut
+
+    def call(self, op, payload=None, timeout=None):
+        return self.submit(op, payload).result(timeout=timeout)
+
+    def discard(self, request_futures):
+        for request_id, fut in list(self._pending.items()):
+            if fut in request_futures:
+                self._pending.pop(request_id, None)
+
+    def stop(self):
+        try:
+            self.call("stop", timeout=5)
+        except Exception:
+            self.process.terminate()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class ShardedSearch(BaseSearchIndex):
+    """
+    Similar member search partitioned by user id across local shard processes. A query
+    is scattered to every shard, each returns its own top-k, and the partial lists are
+    k-way merged. Shards that miss `timeout_ms` are left out and the result is partial.
+    """
+
+    def __init__(self, ids, matrix, num_shards, timeout_ms):
+        super().__init__(ids)
+        self.timeout_s = timeout_ms / 1000.0
+        self.last_missing_shards = []
+        self._ctx = multiprocessing.get_context("spawn")
+        # Held by writes and rebalance, so no row is placed with a shard count that is being changed
+        self._resize_lock = threading.RLock()
+        self.shards = [_ShardClient(self._ctx, i) for i in range(num_shards)]
+        self._distribute(ids, matrix)
+
+    @property
+    def num_shards(self):
+        return len(self.shards)
+
+    def _distribute(self, ids, rows, batch_size=10000):
+        if not len(ids):
+            return
+        with self._resize_lock:
+            shards = self.shards
+            owners = shard_owners(ids, len(shards))
+            futures = []
+            for shard in shards:
+                positions = np.flatnonzero(owners == shard.shard_no)
+                for start in range(0, len(positions), batch_size):
+                    batch = positions[start:start + batch_size]
+                    futures.append(shard.submit("upsert", ([ids[i] for i in batch], rows[batch])))
+            for fut in futures:
+                fut.result()
+
+    def _upsert_many(self, ids, rows, existing):
+        self._distribute(ids, rows)
+
+    def _delete(self, user_ids):
+        with self._resize_lock:
+            for fut in [shard.submit("delete", user_ids) for shard in self.shards]:
+                fut.result()
+
+    def rebalance(self, num_shards):
+        """
+        Changes the shard count, moving only the rows whose owner changes. Searches keep
+        using the old shard list until the switch and may miss the moving rows meanwhile.
+        """
+        with self._resize_lock:
+            if num_shards == self.num_shards or num_shards < 1:
+                return
+            all_shards = self.shards + [_ShardClient(self._ctx, shard_no)
+                                        for shard_no in range(self.num_shards, num_shards)]
+            moved = [shard.call("extract", num_shards) for shard in all_shards]
+            self.shards = all_shards[:num_shards]
+            for shard in all_shards[num_shards:]:
+                shard.stop()
+            for ids, rows in moved:
+                self._distribute(ids, rows)
+
+    def search(self, query, limit=100, min_percentage=30):
+        """Blocks for up to `timeout_ms`; routes call it from the threadpool (`run_blocking`), never on the event loop."""
+        q = np.asarray(query, dtype=np.float32)
+        shards = self.shards
+        futures = [shard.submit("search", (q, limit, min_percentage)) for shard in shards]
+
+        deadline = time.monotonic() + self.timeout_s
+        partials, missing = [], []
+        for shard, fut in zip(shards, futures):
+            try:
+                partials.append(fut.result(timeout=max(0.0, deadline - time.monotonic())))
+            except Exception:
+                missing.append(shard.shard_no)
+                shard.discard([fut])
+        self.last_missing_shards = missing
+        if missing:
+            logger.warning(f"partial similar member search, info:{{'missing_shards': {missing}, 'shards': {len(shards)}}}")
+
+        merged = heapq.merge(*partials, key=lambda match: -match[1])
+        return [{"user_id": user_id, "match_percentage": score}
+                for user_id, score in itertools.islice(merged, limit)]
+
+    def stop(self):
+        for shard in self.shards:
+            shard.stop()
@@ -1,5 +1,17 @@
 from bson import ObjectId
+from starlette.concurrency import run_in_threadpool
+
+from cdots.core.profiling import traced
 
 def get_unique_mongo_id():
     obj_id = ObjectId()
     return str(obj_id)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    Runs blocking work (face inference, bcrypt, in-memory search) in the threadpool so the
+    event loop keeps accepting requests and admission limits apply to work that actually overlaps.
+    The worker thread is included in the request's profile when it is being profiled.
+    """
+    return await run_in_threadpool(traced(fn), *args, **kwargs)
@@ -1,16 +1,73 @@
+import threading
+
 from pymongo import MongoClient
 
+from cdots.core.config import MONGO_URI, MONGO_DB_NAME, MONGO_BACKEND
+
+
+class _Database:
+    """
+    What `get_db()` returns: forwards to the database of the current client, so modules can keep
+    a module-level `db` while the client underneath is closed and reopened across a fork.
+    """
+
+    def __getattr__(self, name):
+        return getattr(MongoDBConnection().db, name)
+
+    def __getitem__(self, name):
+        return MongoDBConnection().db[name]
 
 
 class MongoDBConnection:
+    """
+    Process-wide Mongo client, opened on first use. PyMongo clients are not fork-safe, so a
+    gunicorn master that used Mongo while preloading the app closes it before forking
+    (gunicorn_conf.py) and every worker opens its own on first access.
+    """
     _instance = None
 
-    def __new__(cls, uri="mongodb://localhost:27017/", db_name="cdots"):
+    def __new__(cls, uri=MONGO_URI, db_name=MONGO_DB_NAME):
         if cls._instance is None:
             cls._instance = super(MongoDBConnection, cls).__new__(cls)
-            cls._instance.client = MongoClient(uri)
-            cls._instance.db = cls._instance.client[db_name]
+            cls._instance.uri = uri
+            cls._instance.db_name = db_name
+            cls._instance._client = None
+            cls._instance._db = None
+            cls._instance._lock = threading.Lock()
+            cls._instance._database = _Database()
         return cls._instance
 
+    def _connect(self):
+        with self._lock:
+            if self._client is None:
+                if MONGO_BACKEND == "mongomock":
+                    import mongomock
+                    client = mongomock.MongoClient(self.uri)
+                else:
+                    client = MongoClient(self.uri)
+                self._db = client[self.db_name]
+                self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._connect()
+        return self._client
+
+    @property
+    def db(self):
+        if self._client is None:
+            self._connect()
+        return self._db
+
     def get_db(self):
-        return self.db
+        return self._database
+
+    def close(self):
+        """Closes the client; the next access opens a new one. The in-process mongomock client is kept."""
+        if MONGO_BACKEND == "mongomock":
+            return
+        with self._lock:
+            client, self._client, self._db = self._client, None, None
+        if client is not None:
+            client.close()
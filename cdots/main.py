@@ -8,8 +8,6 @@ import json
 import numpy as np
 import os
 import urllib
-from insightface.app import FaceAnalysis
-from numpy.linalg import norm
 from typing import List
 from fastapi.openapi.models import SecuritySchemeType
 from fastapi.security import OAuth2PasswordBearer
@@ -17,6 +15,14 @@ from fastapi.middleware.cors import CORSMiddleware
 
 
 from cdots.core.logging_config import get_logger
+from cdots.core.profiling import profile_request_middleware
+from cdots.core.admission import admission_control_middleware
+from cdots.core.face_analysis import FaceAppSingleton
+from cdots.core.face_search import SearchIndexSingleton, uses_search_index
+from cdots.core.job_queue import job_queue
+from cdots.core.person_store import PersonStore
+from cdots.core.utils import run_blocking
+from cdots.core.config import FACE_SEARCH_BACKEND
 
 logger = get_logger()
 
@@ -46,9 +52,13 @@ DATA_FILE = "/mnt/git/cdots/data/embeddings.json"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs("data", exist_ok=True)
 
-# Load ArcFace model
-face_app = FaceAnalysis(name="buffalo_l", providers=['CPUExecutionProvider'])
-face_app.prepare(ctx_id=0)
+# Load ArcFace model (shared with the API routers)
+face_app = FaceAppSingleton.get_instance()
+
+# Build the in-memory embedding index at import so a preloading gunicorn master shares it with its workers
+# (the "sharded" backend starts its search processes per worker, at startup)
+if FACE_SEARCH_BACKEND == "memory":
+    SearchIndexSingleton.get_instance()
 
 # Enable CORS if needed
 app.add_middleware(
@@ -59,6 +69,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in per-request profiler (admin header or sampling rate, see profiler_* config)
+app.middleware("http")(profile_request_middleware)
+
+# Bounded queues and fast 503s for inference-heavy routes; added last so it runs first
+app.middleware("http")(admission_control_middleware)
+
 
 
 #  Custom OpenAPI function to register OAuth2 in Swagger UI
@@ -93,18 +109,19 @@ def custom_openapi():
 app.openapi = custom_openapi
 
 # Load existing embeddings
-if os.path.exists(DATA_FILE):
-    with open(DATA_FILE, "r") as f:
-        embeddings_data = json.load(f)
-else:
-    embeddings_data = []
+person_store = PersonStore.load(DATA_FILE)
 
 @app.on_event("startup")
 async def startup_event():
+    if uses_search_index():
+        SearchIndexSingleton.start_sync()
+    job_queue.start()
     logger.info("CDOTS Family Tree API has started!")
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    SearchIndexSingleton.stop()
+    job_queue.stop()
     logger.info("CDOTS Family Tree API is shutting down!")
 
 
@@ -112,6 +129,7 @@ async def shutdown_event():
 from cdots.apis.auth.register import router as register_router
 from cdots.apis.auth.login import router as login_router
 from cdots.apis.cdots_ops.fetch_similar_members import router as fetch_similar_members_router
+from cdots.apis.cdots_ops.group_photos import router as group_photos_router
 from cdots.apis.cdots_ops.family_tree import router as family_tree_route
 from cdots.apis.cdots_ops.relationships import router as relationship_route
 from cdots.apis.auth.me import router as user_profile_router
@@ -121,6 +139,7 @@ app.include_router(login_router)
 app.include_router(family_tree_route)
 app.include_router(relationship_route)
 app.include_router(fetch_similar_members_router)
+app.include_router(group_photos_router)
 app.include_router(user_profile_router)
 
 
@@ -137,37 +156,28 @@ async def upload_image(person_name: str, relation_to: str, relation_type: str, f
         buffer.write(await file.read())
 
     # Load and process image
-    img = cv2.imread(file_path)
-    faces = face_app.get(img)
+    img = await run_blocking(cv2.imread, file_path)
+    faces = await run_blocking(face_app.get, img)
     if not faces:
         return JSONResponse(status_code=400, content={"detail": "No face detected in the image."})
 
     embedding = faces[0].embedding.tolist()  # Convert numpy array to list
 
     # Search for matching faces in stored embeddings
-    matching_persons = []
-    for record in embeddings_data:
-        stored_embedding = np.array(record["embedding"])
-        distance = norm(stored_embedding - np.array(embedding))
-        print(f"matched distance:{distance}")
-        if distance < 0.6:  # ArcFace similarity threshold
-            matching_persons.append({
-                "name": record["name"],
-                "relation": record["relation_to"],
-                "relation_type": record.get("relation_type", "Unknown")
-            })
-
-    # Save new person to file
-    new_record = {
+    matching_persons = [{
+        "name": record["name"],
+        "relation": record["relation_to"],
+        "relation_type": record.get("relation_type", "Unknown")
+    } for record in await run_blocking(person_store.find_within, embedding, 0.6)]  # ArcFace similarity threshold
+
+    # Save new person to file (may compact the journal, so off the event loop)
+    await run_blocking(person_store.add, {
         "name": person_name,
         "relation_to": relation_to,
         "relation_type": relation_type,
         "embedding": embedding,
         "image_path": file_path
-    }
-    embeddings_data.append(new_record)
-    with open(DATA_FILE, "w") as f:
-        json.dump(embeddings_data, f, indent=4)
+    })
 
     return {"message": "Image uploaded and processed successfully.", "suggested_relations": matching_persons}
 
@@ -178,11 +188,11 @@ def get_family_tree(person_name: str):
     """
     Retrieves the family tree for a given person based on stored relationships in the file storage.
     """
-    person = next((p for p in embeddings_data if p["name"] == person_name), None)
+    person = person_store.get(person_name)
     if not person:
         raise HTTPException(status_code=404, detail="Person not found.")
 
-    relations = [p for p in embeddings_data if p["relation_to"] == person_name]
+    relations = person_store.relations_of(person_name)
 
     return {"name": person_name, "family_relations": relations}
 
@@ -0,0 +1,35 @@
+"""
+Preload-and-fork serving mode:
+
+    environment=prd gunicorn -c gunicorn_conf.py runner:app
+
+With preload the master imports the app once, which loads the face model and (with
+"face_search_backend": "memory") builds the embedding index; workers are forked from it
+and share those pages copy-on-write instead of each loading their own copy.
+Set "face_model_threads": 1 in the config so inference sessions hold no thread pool across fork.
+The Mongo client the master used while preloading is closed before forking; workers open
+their own on first use.
+"""
+import gc
+import os
+import sys
+
+bind = os.getenv("CDOTS_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("CDOTS_WORKERS", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("CDOTS_PRELOAD", "1") == "1"
+timeout = 120
+
+
+def pre_fork(server, worker):
+    # PyMongo clients are not fork-safe (pool sockets, monitor threads): drop the master's one
+    if "cdots.db.mongo.mongo_connection" in sys.modules:
+        sys.modules["cdots.db.mongo.mongo_connection"].MongoDBConnection().close()
+    # Move everything allocated so far out of the collector's reach: a gc pass in a
+    # worker would otherwise write to every object header and un-share those pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # The Mongo client is reopened lazily by the first query in this worker
+    server.log.info(f"worker {worker.pid} forked (preload={preload_app})")
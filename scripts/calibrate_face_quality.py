@@ -0,0 +1,77 @@
+"""
+Runs the face quality checks over a folder of photos and reports, per check, the
+distribution of the measured values and how many faces the current thresholds flag:
+
+    environment=prd python -m scripts.calibrate_face_quality /mnt/git/cdots/media/profile_pics --output quality.json
+
+Use a sample of real uploads; profile pictures are what registration sees. Tune the
+`face_quality_*` thresholds until acceptable photos are rarely flagged, and only then
+switch `face_quality_mode` to "reject". Needs the real face model, the fake one has
+fixed landmarks and scores.
+"""
+import argparse
+import collections
+import json
+import os
+
+import cv2
+import numpy as np
+
+from cdots.core.face_analysis import FaceAppSingleton, detect_faces
+from cdots.core.face_quality import assess_face
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+PERCENTILES = [1, 5, 50, 95, 99]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face quality metrics over a folder of photos")
+    parser.add_argument("folder")
+    parser.add_argument("--all-faces", action="store_true", help="assess every face, not only the largest")
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many photos")
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    face_app = FaceAppSingleton.get_instance()
+    metrics = collections.defaultdict(list)
+    reasons = collections.Counter()
+    photos = faces_assessed = flagged = no_face = 0
+    names = sorted(n for n in os.listdir(args.folder) if n.lower().endswith(IMAGE_EXTENSIONS))
+    for name in names[:args.limit or None]:
+        img = cv2.imread(os.path.join(args.folder, name))
+        if img is None:
+            continue
+        photos += 1
+        faces = detect_faces(face_app, img)
+        if not faces:
+            no_face += 1
+            continue
+        if not args.all_faces:
+            # Registration keeps the largest face
+            faces = [max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))]
+        for face in faces:
+            quality = assess_face(img, face)
+            faces_assessed += 1
+            flagged += bool(quality["reasons"])
+            reasons.update(quality["reasons"])
+            metrics["quality_score"].append(quality["quality_score"])
+            for key, value in quality["metrics"].items():
+                metrics[key].append(abs(value) if key == "yaw" else value)
+
+    report = {
+        "photos": photos,
+        "photos_without_face": no_face,
+        "faces": faces_assessed,
+        "flagged_rate": round(flagged / faces_assessed, 4) if faces_assessed else None,
+        "flagged_by_reason": {reason: round(count / faces_assessed, 4) for reason, count in reasons.most_common()},
+        "percentiles": {key: dict(zip(map(str, PERCENTILES), np.round(np.percentile(values, PERCENTILES), 3).tolist()))
+                        for key, values in metrics.items()},
+    }
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compares two-stage (PCA prefilter + exact rerank) search with the exact scan:
+recall of the exact result list and per-query latency.
+
+    python -m scripts.evaluate_pca_search --dims 64 96 128 --candidates 300
+    python -m scripts.evaluate_pca_search --synthetic 200000 --dims 64 128
+
+Queries are stored embeddings with noise added, i.e. another photo of an indexed person.
+`--synthetic N` uses generated embeddings with a low-rank structure instead of Mongo.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from cdots.core.embedding_index import EmbeddingIndex, EMBEDDING_SIZE
+from cdots.core.pca_projection import PcaProjection
+
+
+def synthetic_embeddings(n, rng, latent_dims=128, noise=0.3):
+    """Unit vectors that mostly live in a `latent_dims` subspace, like real face embeddings."""
+    basis = rng.standard_normal((latent_dims, EMBEDDING_SIZE)).astype(np.float32)
+    scales = np.linspace(3.0, 0.5, latent_dims, dtype=np.float32)[:, None]
+    matrix = rng.standard_normal((n, latent_dims)).astype(np.float32) @ (basis * scales)
+    matrix += noise * np.linalg.norm(matrix, axis=1, keepdims=True) / np.sqrt(EMBEDDING_SIZE) \
+        * rng.standard_normal((n, EMBEDDING_SIZE)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def make_queries(matrix, count, rng, noise=0.5):
+    rows = matrix[rng.choice(len(matrix), count, replace=False)]
+    queries = rows + noise * rng.standard_normal(rows.shape).astype(np.float32) / np.sqrt(EMBEDDING_SIZE)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def run_queries(index, queries, limit, min_percentage):
+    results, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append([m["user_id"] for m in index.search(q, limit, min_percentage)])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.percentile(latencies, [50, 95])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate PCA two-stage face search")
+    parser.add_argument("--dims", type=int, nargs="+", default=[64, 96, 128])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[300])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--min-percentage", type=float, default=30)
+    parser.add_argument("--synthetic", type=int, default=0, help="use N generated embeddings instead of Mongo")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.synthetic:
+        matrix = synthetic_embeddings(args.synthetic, rng)
+        ids = [f"{i:024x}" for i in range(len(matrix))]
+    else:
+        from cdots.core.embedding_index import load_embeddings
+        from cdots.db.mongo.mongo_connection import MongoDBConnection
+        ids, matrix = load_embeddings(MongoDBConnection().get_db())
+    queries = make_queries(matrix, min(args.queries, len(matrix)), rng)
+
+    exact, (p50, p95) = run_queries(EmbeddingIndex(ids, matrix), queries, args.limit, args.min_percentage)
+    print(f"{len(matrix)} embeddings, {len(queries)} queries, "
+          f"mean exact results per query {np.mean([len(r) for r in exact]):.1f}")
+    print(f"exact                      p50={p50:.2f}ms p95={p95:.2f}ms")
+
+    fit_rows = rng.choice(len(matrix), min(len(matrix), 200000), replace=False)
+    for dims in args.dims:
+        projection = PcaProjection.fit(matrix[fit_rows], dims)
+        for candidates in args.candidates:
+            index = EmbeddingIndex(ids, matrix, projection=projection, candidates=candidates)
+            approx, (p50, p95) = run_queries(index, queries, args.limit, args.min_percentage)
+            recalls = [len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact) if e]
+            top1 = np.mean([a[:1] == e[:1] for a, e in zip(approx, exact) if e])
+            print(f"dims={dims:<4d} candidates={candidates:<5d} p50={p50:.2f}ms p95={p95:.2f}ms "
+                  f"recall@{args.limit}={np.mean(recalls):.4f} top1={top1:.4f} "
+                  f"(explained variance {projection.explained_variance_ratio.sum():.3f})")
+
+
+if __name__ == "__main__":
+    main()
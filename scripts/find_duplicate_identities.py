@@ -0,0 +1,187 @@
+"""
+Offline all-pairs duplicate identity detection over `users_face_embeddings`:
+
+    python -m scripts.find_duplicate_identities --threshold 0.65 --block-size 4096 --workers 8
+
+The embedding matrix is split into blocks and every block pair (i <= j) is compared with
+one matrix multiply in a worker process, so memory stays at a few block-size squared
+score matrices. Pairs at or above the cosine threshold are clustered with union-find and the
+groups are written to `duplicate_identity_candidates` for review. Progress is checkpointed,
+and rerunning the same command resumes where it stopped.
+"""
+import os
+
+# One BLAS thread per worker process, parallelism comes from the pool
+for _var in ("OPENBLAS_NUM_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(_var, "1")
+
+import argparse
+import datetime
+import hashlib
+import json
+import multiprocessing
+import tempfile
+import time
+
+import numpy as np
+
+from cdots.core.embedding_index import load_embeddings
+from cdots.core.utils import get_unique_mongo_id
+from cdots.db.mongo.mongo_connection import MongoDBConnection
+
+_matrix = None
+
+
+def _init_worker(matrix_path):
+    global _matrix
+    # Memory-mapped, so all workers share the page cache instead of holding copies
+    _matrix = np.load(matrix_path, mmap_mode="r")
+
+
+def _compare_blocks(task):
+    i, j, block_size, threshold = task
+    a_start, b_start = i * block_size, j * block_size
+    a = np.asarray(_matrix[a_start:a_start + block_size])
+    b = a if i == j else np.asarray(_matrix[b_start:b_start + block_size])
+    scores = a @ b.T
+    matches = scores >= threshold
+    if i == j:
+        # Each pair once and no self pairs; a mask, since zeroing them would match thresholds <= 0
+        matches &= np.triu(np.ones(matches.shape, dtype=bool), k=1)
+    rows, cols = np.nonzero(matches)
+    return i, j, [(int(a_start + r), int(b_start + c), float(scores[r, c])) for r, c in zip(rows, cols)]
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        self.parent.setdefault(x, x)
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def load_checkpoint(path, fingerprint):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("fingerprint") == fingerprint:
+            return checkpoint
+        print("checkpoint belongs to a different dataset or settings, starting over")
+    return {"fingerprint": fingerprint, "done": [], "edges": [], "elapsed_s": 0.0}
+
+
+def save_checkpoint(path, checkpoint):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def build_groups(edges):
+    uf = UnionFind()
+    for a, b, _ in edges:
+        uf.union(a, b)
+    groups = {}
+    for a, b, score in edges:
+        group = groups.setdefault(uf.find(a), {"members": set(), "edges": 0, "max_score": score, "min_score": score})
+        group["members"].update((a, b))
+        group["edges"] += 1
+        group["max_score"] = max(group["max_score"], score)
+        group["min_score"] = min(group["min_score"], score)
+    return list(groups.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find candidate duplicate identities")
+    parser.add_argument("--threshold", type=float, default=0.65, help="cosine similarity for a duplicate pair")
+    parser.add_argument("--block-size", type=int, default=4096)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--checkpoint", default="duplicate_identities.checkpoint.json")
+    parser.add_argument("--checkpoint-every", type=int, default=50, help="block pairs between checkpoints")
+    parser.add_argument("--dry-run", action="store_true", help="report groups without writing them")
+    args = parser.parse_args()
+
+    db = MongoDBConnection().get_db()
+    ids, matrix = load_embeddings(db)
+    # Custom-mode members are stored unnormalized, compare on unit vectors
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms == 0, 1, norms)
+
+    fingerprint = hashlib.sha1("\n".join(ids).encode() + f"|{args.threshold}|{args.block_size}".encode()).hexdigest()
+    checkpoint = load_checkpoint(args.checkpoint, fingerprint)
+    done = {tuple(pair) for pair in checkpoint["done"]}
+
+    num_blocks = (len(ids) + args.block_size - 1) // args.block_size
+    tasks = [(i, j, args.block_size, args.threshold)
+             for i in range(num_blocks) for j in range(i, num_blocks) if (i, j) not in done]
+    print(f"{len(ids)} embeddings, {num_blocks} blocks, {len(tasks)} of "
+          f"{num_blocks * (num_blocks + 1) // 2} block pairs to compare")
+
+    start = time.perf_counter()
+    pairs_compared = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        matrix_path = os.path.join(tmp_dir, "embeddings.npy")
+        np.save(matrix_path, matrix.astype(np.float32))
+        with multiprocessing.get_context("spawn").Pool(args.workers, _init_worker, (matrix_path,)) as pool:
+            for n, (i, j, edges) in enumerate(pool.imap_unordered(_compare_blocks, tasks), start=1):
+                a_rows = min(args.block_size, len(ids) - i * args.block_size)
+                b_rows = min(args.block_size, len(ids) - j * args.block_size)
+                pairs_compared += a_rows * (a_rows - 1) // 2 if i == j else a_rows * b_rows
+                checkpoint["done"].append([i, j])
+                checkpoint["edges"].extend([ids[a], ids[b], score] for a, b, score in edges)
+                if n % args.checkpoint_every == 0 or n == len(tasks):
+                    checkpoint["elapsed_s"] += time.perf_counter() - start
+                    start = time.perf_counter()
+                    save_checkpoint(args.checkpoint, checkpoint)
+                    print(f"{n}/{len(tasks)} block pairs, {len(checkpoint['edges'])} duplicate pairs so far")
+    checkpoint["elapsed_s"] += time.perf_counter() - start
+
+    groups = build_groups(checkpoint["edges"])
+    run_id = get_unique_mongo_id()
+    if not args.dry_run:
+        # Earlier unreviewed candidates are superseded by this run; reviewed ones are kept
+        db.duplicate_identity_candidates.delete_many({"status": "pending_review"})
+        if groups:
+            db.duplicate_identity_candidates.insert_many([{
+                "_id": get_unique_mongo_id(),
+                "run_id": run_id,
+                "user_ids": sorted(group["members"]),
+                "size": len(group["members"]),
+                "pair_count": group["edges"],
+                "max_score": round(group["max_score"], 4),
+                "min_pair_score": round(group["min_score"], 4),
+                "threshold": args.threshold,
+                "status": "pending_review",
+                "t__created_at": datetime.datetime.now(),
+            } for group in groups])
+        if args.checkpoint and os.path.exists(args.checkpoint):
+            os.remove(args.checkpoint)
+
+    elapsed = checkpoint["elapsed_s"]
+    print(json.dumps({
+        "run_id": run_id,
+        "embeddings": len(ids),
+        "block_size": args.block_size,
+        "workers": args.workers,
+        "pairs_compared_this_session": pairs_compared,
+        "elapsed_s": round(elapsed, 2),
+        "pairs_per_s": round(len(ids) * (len(ids) - 1) / 2 / elapsed, 1) if elapsed else None,
+        "duplicate_pairs": len(checkpoint["edges"]),
+        "groups": len(groups),
+        "largest_group": max((len(g["members"]) for g in groups), default=0),
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Fits the PCA projection used by two-stage similar member search and saves it:
+
+    python -m scripts.fit_pca_projection --dims 96 --output /mnt/git/cdots/data/face_pca_96.npz
+
+then set "face_search_pca_path" to the output file in the environment config.
+"""
+import argparse
+
+import numpy as np
+
+from cdots.core.embedding_index import load_embeddings
+from cdots.core.pca_projection import PcaProjection
+from cdots.db.mongo.mongo_connection import MongoDBConnection
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit PCA projection on users_face_embeddings")
+    parser.add_argument("--dims", type=int, default=96)
+    parser.add_argument("--sample", type=int, default=200000, help="max embeddings used for the fit")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    _, matrix = load_embeddings(MongoDBConnection().get_db())
+    if len(matrix) < args.dims:
+        raise SystemExit(f"need at least {args.dims} embeddings to fit, found {len(matrix)}")
+    if len(matrix) > args.sample:
+        rows = np.random.default_rng(args.seed).choice(len(matrix), args.sample, replace=False)
+        matrix = matrix[rows]
+
+    projection = PcaProjection.fit(matrix, args.dims)
+    projection.save(args.output)
+    print(f"fitted {args.dims} components on {len(matrix)} embeddings, "
+          f"explained variance {projection.explained_variance_ratio.sum():.3f}, saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Measures memory per gunicorn worker for several worker counts, with and without preload:
+
+    environment=prd python scripts/measure_worker_memory.py --workers 1 4 8
+    environment=bench_memory python scripts/measure_worker_memory.py --app bench.seeded_app:app
+
+Reads RSS, PSS and USS from /proc/<pid>/smaps_rollup (Linux only). PSS splits shared
+pages between the processes that map them, so the PSS total is the real footprint.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+def read_memory_kb(pid):
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].rstrip(":") in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss_mb": round(values.get("Rss", 0) / 1024, 1),
+        "pss_mb": round(values.get("Pss", 0) / 1024, 1),
+        "uss_mb": round((values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)) / 1024, 1),
+    }
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def wait_until_ready(url, workers, master_pid, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=2)
+            if len(children(master_pid)) >= workers:
+                return True
+        except Exception:
+            pass
+        time.sleep(1)
+    return False
+
+
+def measure(app, workers, preload, port, settle_s, timeout):
+    env = dict(os.environ, CDOTS_WORKERS=str(workers), CDOTS_PRELOAD="1" if preload else "0",
+               CDOTS_BIND=f"127.0.0.1:{port}")
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", app], env=env)
+    try:
+        if not wait_until_ready(f"http://127.0.0.1:{port}/docs", workers, proc.pid, timeout):
+            raise RuntimeError(f"gunicorn with {workers} workers did not come up")
+        time.sleep(settle_s)
+        master = read_memory_kb(proc.pid)
+        worker_stats = [read_memory_kb(pid) for pid in children(proc.pid)]
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait()
+    total_pss = master["pss_mb"] + sum(w["pss_mb"] for w in worker_stats)
+    return {
+        "workers": workers,
+        "preload": preload,
+        "master": master,
+        "per_worker_pss_mb": round(sum(w["pss_mb"] for w in worker_stats) / len(worker_stats), 1),
+        "per_worker_uss_mb": round(sum(w["uss_mb"] for w in worker_stats) / len(worker_stats), 1),
+        "total_pss_mb": round(total_pss, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure gunicorn memory per worker")
+    parser.add_argument("--app", default="runner:app", help="gunicorn app; bench.seeded_app:app adds a synthetic index")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--port", type=int, default=8077)
+    parser.add_argument("--settle", type=float, default=5.0, help="seconds to wait after workers are up")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for workers in args.workers:
+        for preload in (False, True):
+            result = measure(args.app, workers, preload, args.port, args.settle, args.timeout)
+            results.append(result)
+            print(f"workers={workers} preload={str(preload):5s} per-worker PSS={result['per_worker_pss_mb']}MB "
+                  f"USS={result['per_worker_uss_mb']}MB total PSS={result['total_pss_mb']}MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
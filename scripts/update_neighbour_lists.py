@@ -0,0 +1,95 @@
+"""
+Keeps the precomputed similar member lists in `user_similar_members` up to date:
+
+    python -m scripts.update_neighbour_lists --rebuild          # recompute every list once
+    python -m scripts.update_neighbour_lists --watch            # follow new registrations
+
+Run a single watcher per deployment. Progress is stored in `job_state` (_id "neighbour_lists"),
+so a restarted watcher first processes the users that registered while it was down. Deleted and
+replaced embeddings are picked up by a full reconcile on start and every `neighbour_list_reconcile_s`.
+"""
+import argparse
+import datetime
+import time
+
+from bson import ObjectId
+
+from cdots.core.config import NEIGHBOUR_LIST_K, NEIGHBOUR_LIST_POLL_S, NEIGHBOUR_LIST_RECONCILE_S
+from cdots.core.embedding_index import id_time
+from cdots.core.logging_config import get_logger
+from cdots.core.neighbour_lists import ADD_BATCH, NeighbourLists
+from cdots.db.mongo.mongo_connection import MongoDBConnection
+
+logger = get_logger()
+
+JOB_ID = "neighbour_lists"
+# ObjectIds from different processes are only ordered by their leading timestamp
+POLL_OVERLAP_S = 2
+
+
+def save_watermark(db, watermark):
+    db.job_state.update_one({"_id": JOB_ID}, {"$set": {"watermark": watermark,
+                                                       "t__updated_at": datetime.datetime.now()}}, upsert=True)
+
+
+def add_in_batches(lists, ids, embeddings):
+    written = 0
+    for start in range(0, len(ids), ADD_BATCH):
+        written += lists.add_users(ids[start:start + ADD_BATCH], embeddings[start:start + ADD_BATCH])
+    return written
+
+
+def watch(db, lists):
+    last_reconcile = time.monotonic()
+    while True:
+        if time.monotonic() - last_reconcile >= NEIGHBOUR_LIST_RECONCILE_S:
+            last_reconcile = time.monotonic()
+            lists.reconcile()
+        since = lists.watermark - datetime.timedelta(seconds=POLL_OVERLAP_S) if lists.watermark else None
+        query = {"_id": {"$gte": str(ObjectId.from_datetime(since))}} if since else {}
+        ids, embeddings = [], []
+        for doc in db.users_face_embeddings.find(query, {"user_id": 1, "face_embedding": 1}).sort("_id", 1):
+            doc_time = id_time(doc["_id"])
+            if doc_time and (lists.watermark is None or doc_time > lists.watermark):
+                lists.watermark = doc_time
+            if str(doc["user_id"]) not in lists.positions:
+                ids.append(doc["user_id"])
+                embeddings.append(doc.get("face_embedding"))
+        if ids:
+            written = add_in_batches(lists, ids, embeddings)
+            logger.info(f"neighbour lists updated, info:{{'new_users': {len(ids)}, 'lists_written': {written}}}")
+        if lists.watermark:
+            save_watermark(db, lists.watermark)
+        time.sleep(NEIGHBOUR_LIST_POLL_S)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain precomputed similar member lists")
+    parser.add_argument("--rebuild", action="store_true", help="recompute all lists before anything else")
+    parser.add_argument("--watch", action="store_true", help="keep updating lists as users register")
+    parser.add_argument("--k", type=int, default=NEIGHBOUR_LIST_K)
+    args = parser.parse_args()
+    if not args.rebuild and not args.watch:
+        parser.error("pass --rebuild, --watch or both")
+
+    db = MongoDBConnection().get_db()
+    lists = NeighbourLists(db, args.k)
+    state = db.job_state.find_one({"_id": JOB_ID}) or {}
+
+    if args.rebuild or not state.get("watermark"):
+        lists.load()
+        lists.rebuild_all()
+    else:
+        pending_ids, pending_embeddings = lists.load(processed_until=state["watermark"].replace(tzinfo=datetime.timezone.utc))
+        written = add_in_batches(lists, pending_ids, pending_embeddings)
+        logger.info(f"neighbour lists caught up, info:{{'new_users': {len(pending_ids)}, 'lists_written': {written}}}")
+        lists.reconcile()
+    if lists.watermark:
+        save_watermark(db, lists.watermark)
+
+    if args.watch:
+        watch(db, lists)
+
+
+if __name__ == "__main__":
+    main()
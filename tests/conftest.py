@@ -0,0 +1,4 @@
+import os
+
+# cdots.core.config reads its environment at import time; the bench config needs no services
+os.environ.setdefault("environment", "bench")
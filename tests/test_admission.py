@@ -0,0 +1,162 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from cdots.core import admission
+from cdots.core.admission import ConcurrencyLimiter, Overloaded
+
+
+def deadline_in(seconds):
+    return asyncio.get_running_loop().time() + seconds
+
+
+def test_free_slot_is_taken_without_waiting():
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", concurrency=2, queue=1, max_wait_ms=1000)
+        await limiter.acquire(deadline_in(0))
+        await limiter.acquire(deadline_in(0))
+        assert limiter.active == 2 and not limiter.waiters
+        limiter.release(0.5)
+        limiter.release(1.5)
+        assert limiter.active == 0 and limiter.avg_service_s == pytest.approx(0.7)
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_is_rejected_up_front():
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", concurrency=1, queue=1, max_wait_ms=1000)
+        await limiter.acquire(deadline_in(1))
+        waiter = asyncio.ensure_future(limiter.acquire(deadline_in(1)))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            await limiter.acquire(deadline_in(1))
+        limiter.release()
+        await waiter
+        assert limiter.active == 1 and not limiter.waiters
+
+    asyncio.run(scenario())
+
+
+def test_rejected_when_the_expected_wait_exceeds_the_deadline():
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", concurrency=1, queue=10, max_wait_ms=1000)
+        limiter.avg_service_s = 5.0
+        await limiter.acquire(deadline_in(1))
+        with pytest.raises(Overloaded) as e:
+            await limiter.acquire(deadline_in(1))
+        assert e.value.retry_after == 5
+        assert not limiter.waiters
+        # A deadline past the expected wait queues instead
+        waiter = asyncio.ensure_future(limiter.acquire(deadline_in(10)))
+        await asyncio.sleep(0)
+        assert len(limiter.waiters) == 1
+        waiter.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_waiter_still_queued_at_its_deadline_is_rejected():
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", concurrency=1, queue=10, max_wait_ms=1000)
+        await limiter.acquire(deadline_in(1))
+        with pytest.raises(Overloaded):
+            await limiter.acquire(deadline_in(0.01))
+        assert not limiter.waiters and limiter.active == 1
+
+    asyncio.run(scenario())
+
+
+def test_slot_handed_to_a_waiter_that_times_out_is_passed_on(monkeypatch):
+    real_wait_for = asyncio.wait_for
+    calls = []
+
+    async def handed_over_at_timeout(fut, timeout):
+        calls.append(fut)
+        if len(calls) > 1:
+            return await real_wait_for(fut, timeout)
+        await asyncio.sleep(0)  # let the second waiter queue up
+        limiter.release()  # the slot is handed to this waiter...
+        raise asyncio.TimeoutError  # ...just as its wait times out
+
+    monkeypatch.setattr(admission.asyncio, "wait_for", handed_over_at_timeout)
+    limiter = ConcurrencyLimiter("test", concurrency=1, queue=10, max_wait_ms=1000)
+
+    async def scenario():
+        await limiter.acquire(deadline_in(1))
+        first = asyncio.ensure_future(limiter.acquire(deadline_in(1)))
+        second = asyncio.ensure_future(limiter.acquire(deadline_in(1)))
+        with pytest.raises(Overloaded):
+            await first
+        await second
+        assert limiter.active == 1 and not limiter.waiters
+        limiter.release()
+        assert limiter.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", concurrency=1, queue=10, max_wait_ms=1000)
+        await limiter.acquire(deadline_in(1))
+        waiter = asyncio.ensure_future(limiter.acquire(deadline_in(1)))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert not limiter.waiters
+        limiter.release()
+        assert limiter.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_saturated_route_answers_503_while_other_routes_are_served(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(admission, "route_limiters", {
+        "/api/v1/register": ConcurrencyLimiter("/api/v1/register", concurrency=1, queue=1, max_wait_ms=5000)})
+    monkeypatch.setattr(admission, "inference_limiter", ConcurrencyLimiter("inference", 2, queue=1 << 16, max_wait_ms=0))
+
+    app = FastAPI()
+    app.middleware("http")(admission.admission_control_middleware)
+    started, gate = [], {}
+
+    @app.post("/api/v1/register")
+    async def register():
+        started.append(True)
+        await gate["open"].wait()
+        return {"registered": True}
+
+    @app.post("/api/v1/login")
+    async def login():
+        return {"access_token": "t"}
+
+    @app.get("/api/v1/me")
+    async def me():
+        return {"user_id": "u"}
+
+    async def scenario():
+        gate["open"] = asyncio.Event()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            running = asyncio.ensure_future(client.post("/api/v1/register"))
+            while not started:
+                await asyncio.sleep(0.01)
+            queued = asyncio.ensure_future(client.post("/api/v1/register"))
+            while not admission.route_limiters["/api/v1/register"].waiters:
+                await asyncio.sleep(0.01)
+
+            rejected = await client.post("/api/v1/register")
+            assert rejected.status_code == 503 and int(rejected.headers["Retry-After"]) >= 1
+            assert (await client.post("/api/v1/login")).status_code == 200
+            assert (await client.get("/api/v1/me")).status_code == 200
+
+            gate["open"].set()
+            assert [(await r).status_code for r in (running, queued)] == [200, 200]
+        limiter = admission.route_limiters["/api/v1/register"]
+        assert limiter.active == 0 and admission.inference_limiter.active == 0
+
+    asyncio.run(scenario())
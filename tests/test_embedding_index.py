@@ -0,0 +1,152 @@
+import mongomock
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from cdots.core import embedding_index
+from cdots.core.embedding_index import EMBEDDING_SIZE, EmbeddingIndex
+from cdots.core.pca_projection import PcaProjection
+
+
+def unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def around(query, cosine, rng):
+    """A unit vector whose dot product with the unit vector `query` is `cosine`."""
+    noise = rng.standard_normal(EMBEDDING_SIZE).astype(np.float32)
+    noise -= noise @ query * query
+    return unit(cosine * query + np.sqrt(1 - cosine ** 2) * unit(noise))
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.fixture
+def query(rng):
+    return unit(rng.standard_normal(EMBEDDING_SIZE))
+
+
+def new_ids(n):
+    return [str(ObjectId()) for _ in range(n)]
+
+
+def build(ids, rows, **kwargs):
+    return EmbeddingIndex(ids, np.asarray(rows, dtype=np.float32).reshape(len(ids), EMBEDDING_SIZE), **kwargs)
+
+
+def result_ids(matches):
+    return [m["user_id"] for m in matches]
+
+
+def test_search_orders_by_score_and_applies_limit_and_threshold(rng, query):
+    ids = new_ids(5)
+    cosines = [0.5, 0.9, 0.2, 0.7, 0.35]
+    index = build(ids, [around(query, c, rng) for c in cosines])
+
+    matches = index.search(query, limit=10, min_percentage=30)
+    assert result_ids(matches) == [ids[1], ids[3], ids[0], ids[4]]
+    assert [m["match_percentage"] for m in matches] == pytest.approx([90, 70, 50, 35], abs=1e-3)
+    assert result_ids(index.search(query, limit=2, min_percentage=30)) == [ids[1], ids[3]]
+    assert result_ids(index.search(query, limit=10, min_percentage=60)) == [ids[1], ids[3]]
+
+
+def test_add_and_upsert_go_to_the_delta(rng, query):
+    base_ids = new_ids(3)
+    index = build(base_ids, [around(query, c, rng) for c in (0.4, 0.5, 0.6)])
+    added = str(ObjectId())
+
+    index.add(added, around(query, 0.8, rng))
+    assert added in index and len(index) == 4
+    assert result_ids(index.search(query)) == [added, base_ids[2], base_ids[1], base_ids[0]]
+
+    # add() keeps an indexed embedding, upsert_many() replaces it; replacing a base row tombstones it
+    index.add(added, around(query, 0.1, rng))
+    index.upsert_many([base_ids[0], added], [around(query, 0.95, rng), around(query, 0.45, rng)])
+    matches = index.search(query)
+    assert result_ids(matches) == [base_ids[0], base_ids[2], base_ids[1], added]
+    assert len(matches) == 4
+
+
+def test_delete_removes_base_and_delta_rows(rng, query):
+    base_ids = new_ids(3)
+    index = build(base_ids, [around(query, c, rng) for c in (0.4, 0.5, 0.6)])
+    added = new_ids(2)
+    index.upsert_many(added, [around(query, 0.7, rng), around(query, 0.8, rng)])
+
+    index.delete([base_ids[1], added[0]])
+    assert base_ids[1] not in index and added[0] not in index
+    assert result_ids(index.search(query)) == [added[1], base_ids[2], base_ids[0]]
+    assert result_ids(index.search_many([query])[0]) == [added[1], base_ids[2], base_ids[0]]
+
+
+def test_compaction_folds_delta_and_tombstones_into_base(rng, query, monkeypatch):
+    monkeypatch.setattr(embedding_index, "COMPACT_MIN_ROWS", 2)
+    base_ids = new_ids(3)
+    index = build(base_ids, [around(query, c, rng) for c in (0.4, 0.5, 0.6)])
+    index.delete([base_ids[0]])
+    added = new_ids(3)
+    index.upsert_many(added, [around(query, c, rng) for c in (0.7, 0.8, 0.9)])
+
+    assert len(index._delta) == 0 and index._tombstones is None
+    assert sorted(index.base_ids) == sorted(base_ids[1:] + added)
+    assert result_ids(index.search(query)) == [added[2], added[1], added[0], base_ids[2], base_ids[1]]
+
+
+def test_search_many_matches_search(rng):
+    ids = new_ids(50)
+    index = build(ids, unit(rng.standard_normal((50, EMBEDDING_SIZE))))
+    index.upsert_many(new_ids(5), unit(rng.standard_normal((5, EMBEDDING_SIZE))))
+    index.delete(ids[:5])
+    queries = [index._snapshot.base_matrix[10], index._snapshot.delta_rows[2]]
+
+    batched = index.search_many(queries, limit=5, min_percentage=-100)
+    single = [index.search(q, limit=5, min_percentage=-100) for q in queries]
+    assert [result_ids(m) for m in batched] == [result_ids(m) for m in single]
+    for batched_matches, single_matches in zip(batched, single):
+        assert [m["match_percentage"] for m in batched_matches] == pytest.approx(
+            [m["match_percentage"] for m in single_matches], abs=1e-3)
+
+
+def test_two_stage_search_finds_the_exact_best_matches(rng, query):
+    ids = new_ids(400)
+    rows = unit(rng.standard_normal((400, EMBEDDING_SIZE)))
+    rows[7], rows[99] = around(query, 0.9, rng), around(query, 0.8, rng)
+    projection = PcaProjection.fit(rows, 64)
+    index = build(ids, rows, projection=projection, candidates=50)
+
+    assert result_ids(index.search(query, limit=2)) == [ids[7], ids[99]]
+
+
+def test_published_snapshots_are_not_modified_by_writes(rng, query):
+    base_ids = new_ids(2)
+    index = build(base_ids, [around(query, c, rng) for c in (0.4, 0.5)])
+    added = new_ids(2)
+    index.upsert_many(added, [around(query, 0.7, rng), around(query, 0.8, rng)])
+    snapshot = index._snapshot
+    delta_rows = snapshot.delta_rows.copy()
+
+    index.upsert_many([added[0], base_ids[0]], [around(query, 0.1, rng), around(query, 0.1, rng)])
+    index.delete([added[1], base_ids[1]])
+    index.upsert_many(new_ids(1), [around(query, 0.99, rng)])
+
+    assert index._snapshot is not snapshot
+    assert snapshot.tombstones is None
+    assert list(snapshot.delta_ids[:len(snapshot.delta_rows)]) == added
+    np.testing.assert_array_equal(snapshot.delta_rows, delta_rows)
+
+
+def test_load_embeddings_sorts_by_user_id_and_skips_invalid_rows(rng):
+    db = mongomock.MongoClient().cdots_test
+    ids = new_ids(4)
+    rows = unit(rng.standard_normal((4, EMBEDDING_SIZE)))
+    db.users_face_embeddings.insert_many(
+        [{"_id": i, "user_id": i, "face_embedding": r.tolist()} for i, r in reversed(list(zip(ids, rows)))]
+        + [{"_id": "short", "user_id": "short", "face_embedding": [0.1, 0.2]}, {"_id": "none", "user_id": "none"}])
+
+    loaded_ids, matrix = embedding_index.load_embeddings(db)
+    assert loaded_ids == sorted(ids)
+    np.testing.assert_allclose(matrix, rows[np.argsort(ids)])
@@ -0,0 +1,96 @@
+import cv2
+import numpy as np
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from cdots.core import face_quality
+from cdots.core.face_quality import assess_face, check_face_quality
+from cdots.core.fake_face_analysis import FakeFaceAnalysis
+
+
+@pytest.fixture
+def photo():
+    """A 256px textured image, sharp enough to pass the Laplacian check."""
+    rng = np.random.default_rng(0)
+    return cv2.resize(rng.integers(0, 256, (64, 64, 3), dtype=np.uint8), (256, 256), interpolation=cv2.INTER_NEAREST)
+
+
+@pytest.fixture
+def face(photo):
+    return FakeFaceAnalysis().detect(photo)[0]
+
+
+def test_pose_from_landmarks(face):
+    yaw, pitch = face_quality._pose(face.kps)
+    assert yaw == pytest.approx(0)
+    assert pitch == pytest.approx((0.55 - 0.4) / (0.75 - 0.4), abs=1e-4)
+
+    side = face.bbox[2] - face.bbox[0]
+    turned = face.kps.copy()
+    turned[2, 0] += 0.2 * side  # nose half the eye distance towards the right eye
+    yaw, _ = face_quality._pose(turned)
+    assert yaw == pytest.approx(0.5)
+
+    raised = face.kps.copy()
+    raised[2, 1] -= 0.1 * side  # nose close to the eye line
+    _, pitch = face_quality._pose(raised)
+    assert pitch == pytest.approx(0.05 / 0.35, abs=1e-4)
+
+
+def test_frontal_sharp_face_passes(photo, face):
+    quality = assess_face(photo, face)
+    assert quality["reasons"] == []
+    assert quality["metrics"]["yaw"] == 0 and quality["metrics"]["sharpness"] > 30
+    assert 0.75 < quality["quality_score"] <= 1
+
+
+def test_turned_face_is_extreme_pose(photo, face):
+    face.kps[2, 0] += 0.2 * (face.bbox[2] - face.bbox[0])
+    quality = assess_face(photo, face)
+    assert quality["reasons"] == ["extreme_pose"]
+    assert quality["quality_score"] < assess_face(photo, FakeFaceAnalysis().detect(photo)[0])["quality_score"]
+
+
+def test_blurred_crop_is_blurry(photo, face):
+    blurred = cv2.GaussianBlur(photo, (0, 0), 6)
+    quality = assess_face(blurred, face)
+    assert "blurry" in quality["reasons"]
+    assert quality["metrics"]["sharpness"] < assess_face(photo, face)["metrics"]["sharpness"]
+
+
+def test_small_low_score_face(photo, face):
+    face.bbox = np.array([100, 100, 120, 120], dtype=np.float32)
+    face.det_score = np.float32(0.3)
+    assert {"low_detection_score", "face_too_small"} <= set(assess_face(photo, face)["reasons"])
+
+
+def test_modes(monkeypatch, photo, face):
+    blurred = cv2.GaussianBlur(photo, (0, 0), 6)
+    monkeypatch.setattr(face_quality, "FACE_QUALITY_MODE", "off")
+    assert check_face_quality(blurred, face) is None
+
+    monkeypatch.setattr(face_quality, "FACE_QUALITY_MODE", "flag")
+    assert check_face_quality(blurred, face)["reasons"] == ["blurry"]
+
+    monkeypatch.setattr(face_quality, "FACE_QUALITY_MODE", "reject")
+    assert check_face_quality(photo, face)["reasons"] == []
+    with pytest.raises(HTTPException) as e:
+        check_face_quality(blurred, face)
+    assert e.value.status_code == 400 and e.value.detail["reasons"] == ["blurry"]
+
+
+def test_reject_mode_stops_registration_before_recognition(monkeypatch, photo):
+    from cdots.apis.auth import register
+
+    embedded = []
+    monkeypatch.setattr(face_quality, "FACE_QUALITY_MODE", "reject")
+    monkeypatch.setattr(register, "embed_faces", lambda *args: embedded.append(args))
+    ok, img_bytes = cv2.imencode(".jpg", cv2.GaussianBlur(photo, (0, 0), 6))
+    email = f"{ObjectId()}@example.com"
+
+    with pytest.raises(HTTPException) as e:
+        register.create_user_with_face("Blurry Person", email, "hash", img_bytes.tobytes(), "blurry.jpg")
+    assert e.value.status_code == 400 and "blurry" in e.value.detail["reasons"]
+    assert embedded == []
+    assert register.db.users.find_one({"email": email}) is None
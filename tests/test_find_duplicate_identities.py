@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from scripts import find_duplicate_identities
+from scripts.find_duplicate_identities import UnionFind, _compare_blocks, build_groups
+
+
+@pytest.fixture
+def matrix(monkeypatch):
+    vectors = np.array([[1, 0], [0.8, 0.6], [0, 1], [-1, 0], [1, 0]], dtype=np.float32)
+    monkeypatch.setattr(find_duplicate_identities, "_matrix", vectors)
+    return vectors
+
+
+def pairs(result):
+    return sorted((a, b) for a, b, _ in result[2])
+
+
+def test_diagonal_block_reports_each_pair_once(matrix):
+    assert pairs(_compare_blocks((0, 0, 5, 0.75))) == [(0, 1), (0, 4), (1, 4)]
+
+
+def test_diagonal_block_ignores_lower_triangle_with_non_positive_threshold(matrix):
+    result = _compare_blocks((0, 0, 5, -1.0))
+    assert pairs(result) == [(a, b) for a in range(5) for b in range(a + 1, 5)]
+    assert all(score == pytest.approx(matrix[a] @ matrix[b]) for a, b, score in result[2])
+
+
+def test_off_diagonal_block_offsets_rows(matrix):
+    assert pairs(_compare_blocks((0, 1, 3, 0.75))) == [(0, 4), (1, 4)]
+
+
+def test_groups_merge_transitive_pairs():
+    groups = build_groups([("a", "b", 0.9), ("b", "c", 0.7), ("d", "e", 0.8)])
+    assert sorted(sorted(g["members"]) for g in groups) == [["a", "b", "c"], ["d", "e"]]
+    uf = UnionFind()
+    uf.union("x", "y")
+    assert uf.find("y") == uf.find("x")
@@ -0,0 +1,118 @@
+import datetime
+
+import mongomock
+import pytest
+from fastapi import HTTPException
+
+from cdots.core import job_queue as job_queue_module
+from cdots.core.job_queue import JobQueue
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(mongomock.MongoClient().cdots_test)
+    queue.cleaned = []
+    queue.register_handler("echo", lambda payload, set_step: {"echo": payload["value"]},
+                           cleanup=queue.cleaned.append)
+    return queue
+
+
+def stored(queue, job_id):
+    return queue.collection.find_one({"_id": job_id})
+
+
+def test_claim_takes_a_lease_and_reclaims_it_once_expired(queue):
+    job, created = queue.submit("echo", {"value": 1})
+    assert created
+
+    claimed = queue._claim()
+    assert claimed["_id"] == job["_id"] and claimed["status"] == "processing" and claimed["attempts"] == 1
+    assert claimed["lease_until"] > datetime.datetime.now()
+    assert queue._claim() is None
+
+    queue.collection.update_one({"_id": job["_id"]},
+                                {"$set": {"lease_until": datetime.datetime.now() - datetime.timedelta(seconds=1)}})
+    reclaimed = queue._claim()
+    assert reclaimed["_id"] == job["_id"] and reclaimed["attempts"] == 2
+
+
+def test_claim_ignores_kinds_without_handler(queue):
+    queue.submit("unknown", {})
+    assert queue._claim() is None
+
+
+def test_requeue_gives_the_attempt_back(queue):
+    job, _ = queue.submit("echo", {"value": 1})
+    queue._claim()
+    queue._requeue(job["_id"])
+
+    doc = stored(queue, job["_id"])
+    assert doc["status"] == "queued" and doc["attempts"] == 0 and doc["lease_until"] is None
+    assert queue._claim()["attempts"] == 1
+
+
+def test_same_idempotency_key_returns_the_first_job(queue):
+    first, created = queue.submit("echo", {"value": 1}, idempotency_key="k")
+    # A concurrent retry that lost the insert race gets the stored job back
+    second, created_again = queue.submit("echo", {"value": 2}, idempotency_key="k")
+    assert created and not created_again
+    assert second["_id"] == first["_id"] and second["payload"] == {"value": 1}
+    assert queue.collection.count_documents({}) == 1
+    # Keys are scoped by kind
+    assert queue.submit("other", {}, idempotency_key="k")[1]
+
+
+def test_success_drops_the_payload_and_runs_the_cleanup(queue):
+    job, _ = queue.submit("echo", {"value": 7})
+    queue._process(queue._claim())
+
+    doc = stored(queue, job["_id"])
+    assert doc["status"] == "succeeded" and doc["result"] == {"echo": 7}
+    assert "payload" not in doc and doc["t__finished_at"] is not None
+    assert queue.cleaned == [{"value": 7}]
+    assert "payload" not in queue.get(job["_id"])
+
+
+def test_rejected_job_fails_for_good(queue):
+    def reject(payload, set_step):
+        set_step("checking")
+        raise HTTPException(status_code=400, detail="bad")
+
+    queue.register_handler("reject", reject, cleanup=queue.cleaned.append)
+    job, _ = queue.submit("reject", {"value": 1})
+    queue._process(queue._claim())
+
+    doc = stored(queue, job["_id"])
+    assert doc["status"] == "failed" and doc["error"] == {"status_code": 400, "detail": "bad"}
+    assert doc["step"] == "checking" and "payload" not in doc
+    assert queue.cleaned == [{"value": 1}]
+
+
+def test_crash_keeps_the_job_for_a_retry_then_abandons_it(queue, monkeypatch):
+    monkeypatch.setattr(job_queue_module, "JOB_MAX_ATTEMPTS", 2)
+
+    def crash(payload, set_step):
+        raise RuntimeError("boom")
+
+    queue.register_handler("crash", crash, cleanup=queue.cleaned.append)
+    job, _ = queue.submit("crash", {"value": 1})
+    expired = {"$set": {"lease_until": datetime.datetime.now() - datetime.timedelta(seconds=1)}}
+
+    for attempt in (1, 2):
+        claimed = queue._claim()
+        assert claimed["attempts"] == attempt
+        queue._process(claimed)
+        doc = stored(queue, job["_id"])
+        assert doc["status"] == "processing" and doc["payload"] == {"value": 1} and queue.cleaned == []
+        queue.collection.update_one({"_id": job["_id"]}, expired)
+
+    queue._process(queue._claim())
+    doc = stored(queue, job["_id"])
+    assert doc["status"] == "failed" and doc["error"]["detail"] == "Job abandoned after repeated attempts"
+    assert "payload" not in doc and queue.cleaned == [{"value": 1}]
+
+
+def test_finished_jobs_expire(queue):
+    indexes = queue.collection.index_information()
+    ttl = [i for i in indexes.values() if i["key"] == [("t__finished_at", 1)]]
+    assert ttl and ttl[0]["expireAfterSeconds"] > 0
@@ -0,0 +1,91 @@
+import mongomock
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from cdots.core.embedding_index import EMBEDDING_SIZE
+from cdots.core.neighbour_lists import NeighbourLists
+
+
+def unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+@pytest.fixture
+def embeddings():
+    """Users in loose clusters, so most lists hold several neighbours above the 30% cut."""
+    rng = np.random.default_rng(0)
+    centers = unit(rng.standard_normal((6, EMBEDDING_SIZE)))
+    rows = unit(centers[rng.integers(0, len(centers), 120)] + 0.9 * unit(rng.standard_normal((120, EMBEDDING_SIZE))))
+    return {str(ObjectId()): row.tolist() for row in rows}
+
+
+def store(embeddings):
+    db = mongomock.MongoClient().db
+    db.users_face_embeddings.insert_many(
+        [{"user_id": user_id, "face_embedding": embedding} for user_id, embedding in embeddings.items()])
+    return db
+
+
+def stored_lists(db):
+    return {doc["_id"]: [(n["user_id"], n["match_percentage"]) for n in doc["neighbours"]]
+            for doc in db.user_similar_members.find() if doc["neighbours"]}
+
+
+def rebuilt(embeddings, k):
+    db = store(embeddings)
+    lists = NeighbourLists(db, k)
+    lists.load()
+    lists.rebuild_all()
+    return stored_lists(db)
+
+
+def assert_same_lists(actual, expected):
+    assert actual.keys() == expected.keys()
+    for user_id, neighbours in expected.items():
+        assert [n for n, _ in actual[user_id]] == [n for n, _ in neighbours], user_id
+        assert [s for _, s in actual[user_id]] == pytest.approx([s for _, s in neighbours], abs=0.01)
+
+
+def test_add_users_matches_rebuild_all(embeddings):
+    expected = rebuilt(embeddings, k=5)
+    assert sum(map(len, expected.values())) > 2 * len(expected)
+
+    user_ids = list(embeddings)
+    db = store({user_id: embeddings[user_id] for user_id in user_ids[:80]})
+    lists = NeighbourLists(db, 5)
+    lists.load()
+    lists.rebuild_all()
+    for start in range(80, len(user_ids), 15):
+        batch = user_ids[start:start + 15]
+        lists.add_users(batch, [embeddings[user_id] for user_id in batch])
+
+    assert_same_lists(stored_lists(db), expected)
+
+
+def test_reconcile_drops_deleted_and_recomputes_replaced_embeddings(embeddings):
+    db = store(embeddings)
+    lists = NeighbourLists(db, 5)
+    lists.load()
+    lists.rebuild_all()
+    assert lists.reconcile() == 0
+
+    user_ids = list(embeddings)
+    deleted, replaced = user_ids[:10], user_ids[10:20]
+    db.users_face_embeddings.delete_many({"user_id": {"$in": deleted}})
+    rng = np.random.default_rng(1)
+    for n, user_id in enumerate(replaced):
+        # Each replaced user now looks like some other user, so its lists have to move
+        moved = unit(np.asarray(embeddings[user_ids[-1 - n]]) + 0.5 * unit(rng.standard_normal(EMBEDDING_SIZE)))
+        db.users_face_embeddings.update_one({"user_id": user_id}, {"$set": {"face_embedding": moved.tolist()}})
+    added = {str(ObjectId()): unit(np.asarray(embeddings[user_ids[30]]) + 0.5 * unit(rng.standard_normal(EMBEDDING_SIZE))).tolist()}
+    db.users_face_embeddings.insert_many([{"user_id": u, "face_embedding": e} for u, e in added.items()])
+
+    assert lists.reconcile() == len(deleted) + len(replaced) + len(added)
+
+    current = {doc["user_id"]: doc["face_embedding"] for doc in db.users_face_embeddings.find()}
+    actual = stored_lists(db)
+    assert not set(deleted) & {n for user_id, neighbours in actual.items() for n, _ in neighbours}
+    assert not set(deleted) & set(db.user_similar_members.distinct("_id"))
+    assert_same_lists(actual, rebuilt(current, k=5))
@@ -0,0 +1,74 @@
+import json
+import os
+
+import pytest
+
+from cdots.core.person_store import PersonStore
+
+
+def record(name, relation_to="root", value=0.0):
+    return {"name": name, "relation_to": relation_to, "relation_type": "child",
+            "embedding": [value, 1.0 - value, 0.0], "image_path": f"{name}.jpg"}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "data" / "embeddings.json")
+
+
+def test_load_without_files_touches_nothing(tmp_path):
+    path = str(tmp_path / "missing" / "embeddings.json")
+    store = PersonStore.load(path)
+    assert len(store) == 0 and store.find_within([0, 1, 0], 0.6) == []
+    assert not os.path.exists(os.path.dirname(path))
+    store.compact()
+    assert not os.path.exists(os.path.dirname(path))
+
+
+def test_journal_is_replayed_after_the_json_array(path):
+    os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        json.dump([record("a")], f)
+    store = PersonStore.load(path)
+    store.add(record("b", relation_to="a"))
+    store.add(record("c", relation_to="a", value=1.0))
+
+    reloaded = PersonStore.load(path)
+    assert [r["name"] for r in reloaded.records] == ["a", "b", "c"]
+    assert [r["name"] for r in reloaded.relations_of("a")] == ["b", "c"]
+    assert [r["name"] for r in reloaded.find_within([0, 1, 0], 0.6)] == ["a", "b"]
+    with open(path) as f:
+        assert len(json.load(f)) == 1
+
+
+def test_add_compacts_past_compact_bytes(path):
+    store = PersonStore.load(path, compact_bytes=300)
+    store.add(record("a"))
+    assert os.path.exists(store.journal_path) and not os.path.exists(path)
+    store.add(record("b"))
+    store.add(record("c"))
+
+    assert store._journal_size() < 300
+    with open(path) as f:
+        compacted = [r["name"] for r in json.load(f)]
+    assert compacted and [r["name"] for r in PersonStore.load(path).records] == ["a", "b", "c"]
+
+
+def test_load_compacts_a_large_journal_and_keeps_other_writers_records(path):
+    first, second = PersonStore.load(path), PersonStore.load(path)
+    first.add(record("a"))
+    second.add(record("b"))
+
+    store = PersonStore.load(path, compact_bytes=1)
+    assert not os.path.exists(store.journal_path)
+    with open(path) as f:
+        assert [r["name"] for r in json.load(f)] == ["a", "b"]
+
+
+def test_get_returns_the_first_record_with_a_name(path):
+    store = PersonStore.load(path)
+    store.add(record("a", relation_to="x"))
+    store.add(record("a", relation_to="y"))
+    assert store.get("a")["relation_to"] == "x"
+    assert PersonStore.load(path).get("a")["relation_to"] == "x"
+    assert store.get("missing") is None
@@ -0,0 +1,114 @@
+import os
+import signal
+import threading
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from cdots.core.embedding_index import EMBEDDING_SIZE, EmbeddingIndex
+from cdots.core.sharded_search import ShardedSearch, shard_owners
+
+
+def new_ids(n):
+    return [str(ObjectId()) for _ in range(n)]
+
+
+def unit_rows(n, rng):
+    rows = rng.standard_normal((n, EMBEDDING_SIZE)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.fixture
+def index(rng):
+    ids, rows = new_ids(200), unit_rows(200, rng)
+    index = ShardedSearch(ids, rows, num_shards=2, timeout_ms=5000)
+    index.test_ids, index.test_rows = ids, rows
+    yield index
+    index.stop()
+
+
+def shard_counts(index):
+    return [shard.call("upsert", ([], np.empty((0, EMBEDDING_SIZE), np.float32)), timeout=5) for shard in index.shards]
+
+
+def all_ids(index, query):
+    return {m["user_id"] for m in index.search(query, limit=10000, min_percentage=-101)}
+
+
+def test_shard_owners_are_stable_and_move_about_one_nth(rng):
+    ids = new_ids(20000)
+    owners_4 = shard_owners(ids, 4)
+    assert np.array_equal(owners_4, shard_owners(ids, 4))
+    assert np.bincount(owners_4, minlength=4).min() > 20000 / 4 * 0.9
+
+    owners_5 = shard_owners(ids, 5)
+    moved = owners_5 != owners_4
+    # Only rows won by the new shard move, about 1/5 of them
+    assert set(owners_5[moved]) == {4}
+    assert 0.17 < moved.mean() < 0.23
+    # Shrinking back moves exactly those rows back
+    assert np.array_equal(shard_owners(ids, 4), owners_4)
+
+
+def test_search_matches_the_single_process_index(index, rng):
+    exact = EmbeddingIndex(index.test_ids, index.test_rows)
+    query = unit_rows(1, rng)[0]
+    matches = index.search(query, limit=20, min_percentage=-101)
+    assert [m["user_id"] for m in matches] == [m["user_id"] for m in exact.search(query, 20, -101)]
+    assert not index.last_missing_shards
+
+
+def test_rebalance_up_and_down_keeps_every_row(index, rng):
+    query = unit_rows(1, rng)[0]
+    expected = set(index.test_ids)
+    assert sum(shard_counts(index)) == 200
+
+    index.rebalance(4)
+    assert index.num_shards == 4 and sum(shard_counts(index)) == 200
+    assert min(shard_counts(index)) > 0
+    assert all_ids(index, query) == expected
+
+    index.rebalance(1)
+    assert index.num_shards == 1 and shard_counts(index) == [200]
+    assert all_ids(index, query) == expected
+
+
+def test_writes_during_rebalance_use_the_new_shard_count(index, rng):
+    added = new_ids(50)
+    first_shard = index.shards[0]
+    original_call = first_shard.call
+    writer = threading.Thread(target=index.upsert_many, args=(added, unit_rows(50, rng)))
+
+    def call(op, payload=None, timeout=None):
+        result = original_call(op, payload, timeout)
+        if op == "extract":
+            # An index sync upsert arriving while rows are being moved
+            writer.start()
+        return result
+
+    first_shard.call = call
+    index.rebalance(1)
+    writer.join(timeout=10)
+
+    assert shard_counts(index) == [250]
+    assert all_ids(index, unit_rows(1, rng)[0]) == set(index.test_ids) | set(added)
+
+
+def test_slow_shard_gives_a_partial_result(index, rng):
+    index.timeout_s = 0.3
+    slow = index.shards[1]
+    os.kill(slow.process.pid, signal.SIGSTOP)
+    try:
+        matches = index.search(unit_rows(1, rng)[0], limit=1000, min_percentage=-101)
+    finally:
+        os.kill(slow.process.pid, signal.SIGCONT)
+
+    assert index.last_missing_shards == [1]
+    owners = dict(zip(index.test_ids, shard_owners(index.test_ids, 2)))
+    assert matches and all(owners[m["user_id"]] == 0 for m in matches)